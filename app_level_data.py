@@ -1,36 +1,50 @@
-import gspread
-from google.oauth2.service_account import Credentials
-from datetime import datetime
+import argparse
 import json
 import re
 import traceback
 from cleaning import clean_ga4_data_all_apps
+from client_pool import get_sheets_client, SHEETS_SCOPES
+from rolling import indicator_columns
+from run_journal import APP_SHEET, mark_done, pending_apps, run_started_at, start_run
+from records import month_sort_key, sheet_months
+from sheet_writer import DAILY_COLUMNS, append_block, number_formats, update_changed_rows
+from sheet_index import read_column_a, record_append
+from scheduler import call_api
+from telemetry import app_context, export_metrics
 
-def format_currency(value):
-    try:
-        return f"${float(value):.2f}"
-    except (ValueError, TypeError):
-        return value if value else ""
+# GA4 revenue for a day keeps moving for up to ~72h after it is first reported
+DEFAULT_RESTATEMENT_DAYS = 3
 
-def format_percent(value):
-    try:
-        value_str = str(value)
-        if value_str.startswith(("+", "-")):
-            return value_str
-        return f"+{float(value):.1f}%"
-    except (ValueError, TypeError):
-        return value if value else ""
+def _row_values(row, columns):
+    # Numbers go out as numbers; the block's number formats display them
+    return [row.typed(col) for col in columns]
 
-def append_new_unique_rows_all_apps(config_file="apps_config.json"):
+def append_new_unique_rows_all_apps(config_file="apps_config.json", all_apps_monthly_data=None, upsert_days=0,
+                                    app_names=None):
+    """
+    Append rows for dates not yet in each app sheet. With upsert_days, rows
+    from the last `upsert_days` days that are already in the sheet are also
+    diffed against it and their changed cells rewritten in place; data
+    passed in must have been cleaned with the same upsert_days. Only
+    `app_names` are written when given. Returns the apps whose sheet is now
+    up to date; the others were skipped with their reason printed.
+    """
     with open(config_file) as f:
         configs = json.load(f)
+    if app_names:
+        configs = [c for c in configs if c.get("app_name", "Unnamed") in set(app_names)]
+    # A resumed run only cleans and writes the apps it hadn't written yet
+    names = [c.get("app_name", "Unnamed") for c in configs]
+    pending = set(pending_apps(names, APP_SHEET))
+    configs = [c for c in configs if c.get("app_name", "Unnamed") in pending]
+    # Apps this run already wrote are up to date too
+    written = [app for app in names if app not in pending]
+    if not configs:
+        return written
 
-    all_apps_monthly_data = clean_ga4_data_all_apps(config_file)
-
-    scope = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive"
-    ]
+    if all_apps_monthly_data is None:
+        all_apps_monthly_data = clean_ga4_data_all_apps(config_file, app_names=sorted(pending),
+                                                        upsert_days=upsert_days)
 
     for app_config in configs:
         app_name = app_config.get("app_name", "Unnamed")
@@ -58,74 +72,84 @@ def append_new_unique_rows_all_apps(config_file="apps_config.json"):
         if not service_account_info:
             print(f"Missing service_account_info for app '{app_name}'. Skipping.")
             continue
-        creds = Credentials.from_service_account_info(service_account_info, scopes=scope)
-        client = gspread.authorize(creds)
+        client = get_sheets_client(service_account_info, SHEETS_SCOPES)
 
         try:
-            worksheet = client.open_by_key(SHEET_ID).worksheet(SHEET_NAME)
+            worksheet = call_api("sheets", lambda: client.open_by_key(SHEET_ID).worksheet(SHEET_NAME), scope=SHEET_ID)
         except Exception as e:
             print(f"Error opening sheet for app '{app_name}': {e}")
             traceback.print_exc()
             continue
 
-        col_a = worksheet.col_values(1)
+        with app_context(app_name):
+            col_a = read_column_a(worksheet, SHEET_ID, SHEET_NAME)
         # Only consider real date rows, skip month headers and blanks
         existing_dates = set(
             str(cell).strip()
             for cell in col_a
             if "-" in str(cell) and str(cell).strip() not in ["", None] and not str(cell).strip().isalpha()
         )
-        existing_months = set(str(cell).strip() for cell in col_a if "-" not in str(cell) and str(cell).strip())
-        last_row = len(col_a) + 1
+        # Matched on (year, month): backfilled "October 2024" and daily "October" are the same block
+        existing_months = sheet_months(col_a)
+        # Sheet row of each date; a date listed twice is updated at its last row
+        date_rows = {str(cell).strip(): number for number, cell in enumerate(col_a, start=1)}
+        # Relative to the run's day, so a resumed run restates the same days
+        restate_from = run_started_at().toordinal() - upsert_days if upsert_days else None
 
+        rolling_cols = indicator_columns(app_config)
+        columns = list(DAILY_COLUMNS) + rolling_cols
+        formats = number_formats(columns)
         headers = [
             "Gads_Spend", "Total_spend", "Total New Revenue", "Ad Revenue", "IAP_Revenue",
-            "Count of Purchases", "Renewal", "Renewal_Count", "Total Revenue",
-            "ROAS", "ROI", "L3_ROAS", "L7_ROAS", "L14_ROAS",
-            "L3_ROI", "L7_ROI", "L14_ROI", "ROAS_Indicator", "ROI_Indicator"
-        ]
+            "Count of Purchases", "Renewal", "Renewal_Count", "Total Revenue"
+        ] + rolling_cols
 
         all_rows = []
-        for month in sorted(monthly_data, key=lambda m: datetime.strptime(m, "%B").month):
+        restated = {}
+        for month in sorted(monthly_data, key=month_sort_key):
             month_rows = monthly_data[month]
-            new_month_rows = [row for row in month_rows if row["Formatted_Date"] not in existing_dates]
+            if restate_from is not None:
+                for row in month_rows:
+                    if row.day >= restate_from and row.formatted_date in existing_dates:
+                        restated[date_rows[row.formatted_date]] = _row_values(row, columns)
+            new_month_rows = [row for row in month_rows if row.formatted_date not in existing_dates]
             if not new_month_rows:
                 continue
-            if month not in existing_months:
+            new_month_rows.sort(key=lambda r: r.day)
+            if (new_month_rows[0].date.year, new_month_rows[0].date.month) not in existing_months:
                 all_rows.append([month] + headers)
-            new_month_rows.sort(key=lambda r: datetime.strptime(r["Formatted_Date"], "%d-%m-%Y"))
             for row in new_month_rows:
-                row_data = [
-                    row["Formatted_Date"],
-                    format_currency(row["Gads_Spend"]),
-                    format_currency(row["Total_spend"]),
-                    format_currency(row["Total New Revenue"]),
-                    format_currency(row["Ad Revenue"]),
-                    format_currency(row["IAP_Revenue"]),
-                    row["Count of Purchases"],
-                    row["Renewal"],
-                    row["Renewal_Count"],
-                    format_currency(row["Total Revenue"]),
-                    row["ROAS"],
-                    row["ROI"],
-                    row["L3_ROAS"],
-                    row["L7_ROAS"],
-                    row["L14_ROAS"],
-                    row["L3_ROI"],
-                    row["L7_ROI"],
-                    row["L14_ROI"],
-                    format_percent(row["ROAS_Indicator"]),
-                    format_percent(row["ROI_Indicator"])
-                ]
-                all_rows.append(row_data)
-            all_rows.extend([[""] * 21 for _ in range(3)])  # blank rows after each month
+                all_rows.append(_row_values(row, columns))
+            all_rows.extend([[""] * (len(headers) + 2) for _ in range(3)])  # blank rows after each month
+
+        if restated:
+            with app_context(app_name):
+                stats = update_changed_rows(worksheet, restated, formats)
+            print(f"Updated {stats['cells']} cell(s) in {stats['rows']} of {len(restated)} recent row(s) "
+                  f"for app '{app_name}', {stats['cells_saved']} unchanged cell(s) not rewritten.")
 
         if all_rows:
-            worksheet.append_rows(all_rows)
+            with app_context(app_name):
+                stats = append_block(worksheet, all_rows, formats=formats)
+            record_append(SHEET_ID, SHEET_NAME, col_a, all_rows, stats["responses"])
             data_row_count = sum(1 for row in all_rows if any(str(cell).strip() for cell in row))
             print(f"Appended {data_row_count} data row(s) for app '{app_name}', sorted and structured by month.")
         else:
             print(f"No new data to append. All dates already exist in sheet.")
+        mark_done(app_name, APP_SHEET)
+        written.append(app_name)
+    return written
 
 if __name__ == "__main__":
-    append_new_unique_rows_all_apps()
+    parser = argparse.ArgumentParser(description="Append new daily rows to each app's sheet.")
+    parser.add_argument("--config", default="apps_config.json")
+    parser.add_argument("--upsert-days", type=int, nargs="?", const=DEFAULT_RESTATEMENT_DAYS, default=0,
+                        help="Also fix rows from the last N days that are already in the sheet "
+                             f"(default {DEFAULT_RESTATEMENT_DAYS} when given without a value)")
+    parser.add_argument("--run-id", help="Journal name for this run (default: today's date)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the run: skip apps already written, reuse data already fetched")
+    args = parser.parse_args()
+    start_run(args.run_id, args.resume)
+    append_new_unique_rows_all_apps(args.config, upsert_days=args.upsert_days)
+    export_metrics()
@@ -0,0 +1,148 @@
+import argparse
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from client_pool import get_ga4_client
+from cleaning import group_rows_by_month
+from concurrency import run_per_app, DEFAULT_MAX_WORKERS
+from fetch import build_daily_records
+from fetch_campaign_Gads import fetch_gads_range
+from ga4_query import fetch_property_metrics, reset_property_cache
+from metrics_store import get_store
+from rolling import rolling_metrics, rolling_windows
+from run_journal import run_started_at
+from telemetry import export_metrics, stage
+
+# Historical backfill: fetch an explicit [start, end] range for one or more
+# apps, split into date chunks that are fetched concurrently, and hand the
+# result to the usual cleaning/sheet path.
+
+DEFAULT_CHUNK_DAYS = 90
+DEFAULT_CHUNK_WORKERS = 4
+
+
+def split_date_range(start_date, end_date, chunk_days=DEFAULT_CHUNK_DAYS):
+    """[(start_str, end_str), ...] covering start..end in chunk_days pieces."""
+    chunks = []
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end_date)
+        chunks.append((chunk_start.isoformat(), chunk_end.isoformat()))
+        chunk_start = chunk_end + timedelta(days=1)
+    return chunks
+
+
+def backfill_app(app_config, start_date, end_date, chunk_days=DEFAULT_CHUNK_DAYS,
+                 chunk_workers=DEFAULT_CHUNK_WORKERS):
+    """DailyMetrics records for every day in [start_date, end_date]."""
+    app_name = app_config.get("app_name", "Unnamed")
+    windows = rolling_windows(app_config)
+    metrics = rolling_metrics(app_config)
+
+    # Fetch enough days before `start` that its rolling averages are complete
+    fetch_start = start_date - timedelta(days=max(windows, default=1) - 1)
+    chunks = split_date_range(fetch_start, end_date, chunk_days)
+
+    ga4_config = app_config["ga4"]
+    client = get_ga4_client(ga4_config["service_account_info"])
+    property_id = ga4_config["property_id"]
+
+    def _fetch_chunk(chunk):
+        chunk_start, chunk_end = chunk
+        ga4_data_lookup, renewal_data = fetch_property_metrics(client, property_id, chunk_start, chunk_end)
+        gads_data = fetch_gads_range(app_config, chunk_start, chunk_end) if app_config.get("gads") else {}
+        return ga4_data_lookup, renewal_data, gads_data
+
+    with ThreadPoolExecutor(max_workers=max(1, min(chunk_workers, len(chunks)))) as pool:
+        results = list(pool.map(_fetch_chunk, chunks))
+
+    ga4_data_lookup, renewal_data, gads_data = {}, {}, {}
+    for chunk_ga4, chunk_renewal, chunk_gads in results:
+        ga4_data_lookup.update(chunk_ga4)
+        renewal_data.update(chunk_renewal)
+        gads_data.update(chunk_gads)
+
+    # Only save once every chunk succeeded, so the store never has gaps
+    store = get_store()
+    if store is not None:
+        range_start, range_end = fetch_start.isoformat(), end_date.isoformat()
+        # Settled as of when the run started, not whenever the chunks finished
+        today = run_started_at()
+        store.save(app_name, "ga4", ga4_data_lookup, range_start, range_end, today)
+        store.save(app_name, "ga4_renewal", renewal_data, range_start, range_end, today)
+        if app_config.get("gads"):
+            store.save(app_name, "gads", gads_data, range_start, range_end, today)
+
+    records = build_daily_records(
+        ga4_data_lookup, renewal_data, gads_data,
+        fetch_start.toordinal(), end_date.toordinal(), metrics, windows
+    )
+    first_day = start_date.toordinal()
+    return [record for record in records if record.day >= first_day]
+
+
+def backfill_all_apps(config_file="apps_config.json", start_date=None, end_date=None, app_names=None,
+                      chunk_days=DEFAULT_CHUNK_DAYS, chunk_workers=DEFAULT_CHUNK_WORKERS,
+                      max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Backfill every app (or only `app_names`) and return data grouped the way
+    clean_ga4_data_all_apps returns it, ready for the sheet writers.
+    """
+    with open(config_file) as f:
+        configs = json.load(f)
+    if app_names:
+        configs = [c for c in configs if c.get("app_name", "Unnamed") in set(app_names)]
+
+    end_date = end_date or date.today() - timedelta(days=1)
+    if start_date is None or start_date > end_date:
+        raise ValueError("Backfill needs a start date on or before the end date.")
+
+    reset_property_cache()
+    with_year = start_date.year != end_date.year
+
+    all_apps_monthly_data = {}
+    def _backfill(app_config):
+        with stage("backfill", app=app_config.get("app_name", "Unnamed")):
+            return backfill_app(app_config, start_date, end_date, chunk_days, chunk_workers)
+
+    results = run_per_app(configs, _backfill, max_workers)
+    for app_config, records, error in results:
+        app_name = app_config.get("app_name", "Unnamed")
+        if error is not None:
+            print(f"Backfill failed for app '{app_name}': {error}")
+            continue
+        print(f"Backfilled {len(records)} day(s) for app '{app_name}'.")
+        all_apps_monthly_data[app_name] = group_rows_by_month(records, with_year)
+    return all_apps_monthly_data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill historical GA4 and Google Ads data.")
+    parser.add_argument("--start", required=True, type=date.fromisoformat, help="First day, YYYY-MM-DD")
+    parser.add_argument("--end", type=date.fromisoformat, help="Last day, YYYY-MM-DD (default: yesterday)")
+    parser.add_argument("--app", action="append", dest="apps", help="App name to backfill (repeatable)")
+    parser.add_argument("--config", default="apps_config.json")
+    parser.add_argument("--chunk-days", type=int, default=DEFAULT_CHUNK_DAYS)
+    parser.add_argument("--chunk-workers", type=int, default=DEFAULT_CHUNK_WORKERS)
+    parser.add_argument("--write", choices=["none", "app", "warehouse", "both"], default="none",
+                        help="Sheets to write the backfilled rows to")
+    args = parser.parse_args(argv)
+
+    all_apps_monthly_data = backfill_all_apps(
+        args.config, args.start, args.end, args.apps, args.chunk_days, args.chunk_workers
+    )
+
+    if args.write in ("app", "both"):
+        from app_level_data import append_new_unique_rows_all_apps
+        append_new_unique_rows_all_apps(args.config, all_apps_monthly_data)
+    if args.write in ("warehouse", "both"):
+        from google_sheet import append_all_apps_to_sheets
+        append_all_apps_to_sheets(args.config, all_apps_monthly_data)
+    if args.write == "none":
+        from cleaning import print_cleaned_data_grouped_all_apps
+        print_cleaned_data_grouped_all_apps(all_apps_monthly_data)
+    export_metrics()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,591 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from collections import Counter
+from datetime import date, timedelta
+import client_pool
+import scheduler
+from campaign_ids import reset_campaign_id_cache
+from metrics_store import configure_store
+from response_cache import MODE_OFF, configure_response_cache
+from sheet_index import configure_index
+from telemetry import count, reset_metrics, run_summary
+
+# Offline benchmark: runs the real pipeline against in-process fakes of the
+# Ads, GA4 and Sheets APIs (configurable latency, error rate and volume) and
+# reports wall time, API calls, peak memory and rows/sec per stage.
+# The pipeline still builds real GA4 request types, so the SDKs must be
+# installed; a stage that logs errors or handles no rows fails the run.
+#
+#   python benchmark.py --apps 10 100 --days 30 365 --json bench.json
+#   python benchmark.py --apps 100 --days 365 --compare bench.json
+
+# Importing the entry points must stay cheap: cron runs pay it every time,
+# and the Google SDKs may only load once a source is actually used
+STARTUP_BUDGET_MS = 300
+STARTUP_MODULES = ("cleaning", "app_level_data", "google_sheet", "backfill", "breakdowns")
+HEAVY_MODULES = ("google.ads", "google.analytics", "gspread", "google.oauth2")
+
+DEFAULT_APPS = (10,)
+DEFAULT_DAYS = (30,)
+STAGES = ("backfill", "clean", "fetch_ga4_data", "app_sheets", "warehouse", "local_warehouse", "upsert")
+
+_COUNT_METRICS = {"transactions", "eventCount", "totalUsers"}
+_BETWEEN = re.compile(r"BETWEEN '(\d{4}-\d{2}-\d{2})' AND '(\d{4}-\d{2}-\d{2})'")
+_CAMPAIGN_IDS = re.compile(r"campaign\.id IN \(([\d, ]+)\)")
+_CELL_RANGE = re.compile(r"([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?$")
+
+
+class FakeApiError(Exception):
+    """Looks like a gRPC/HTTP quota error to scheduler.error_code()."""
+
+    class _Code:
+        def __init__(self, name):
+            self.name = name
+
+    def __init__(self, name="RESOURCE_EXHAUSTED"):
+        super().__init__(f"fake {name}")
+        self._code = FakeApiError._Code(name)
+
+    def code(self):
+        return self._code
+
+
+class FakeBackend:
+    """Shared behaviour and call counters for the fake services."""
+
+    def __init__(self, latency=0.02, error_rate=0.0, campaigns_per_day=5, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.campaigns_per_day = campaigns_per_day
+        self.calls = Counter()
+        self.rows_served = Counter()
+        self.books = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def call(self, name):
+        with self._lock:
+            self.calls[name] += 1
+            failed = self._random.random() < self.error_rate
+            delay = self.latency * self._random.uniform(0.5, 1.5)
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise FakeApiError()
+
+    def served(self, name, rows):
+        with self._lock:
+            self.rows_served[name] += rows
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.rows_served.clear()
+
+
+def _value(*parts):
+    # Deterministic pseudo-random number per (property, day, metric)
+    return zlib.crc32("|".join(str(p) for p in parts).encode("utf-8"))
+
+
+def _days(start_date_str, end_date_str):
+    day = date.fromisoformat(start_date_str)
+    end = date.fromisoformat(end_date_str)
+    while day <= end:
+        yield day
+        day += timedelta(days=1)
+
+
+class _Obj:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+# --- Google Ads -------------------------------------------------------------
+
+class FakeGoogleAdsService:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _campaign_rows(self, customer_id, query):
+        if "FROM change_status" in query:
+            return []
+        # Campaign-ID lookup: every fake campaign matches the app's prefix
+        return [
+            _Obj(campaign=_Obj(id=campaign + 1, name=f"campaign-{campaign}"))
+            for campaign in range(self.backend.campaigns_per_day)
+        ]
+
+    def _spend_rows(self, customer_id, query, start, end):
+        campaigns = range(self.backend.campaigns_per_day)
+        ids = _CAMPAIGN_IDS.search(query)
+        if ids:
+            wanted = {int(i) - 1 for i in ids.group(1).split(",")}
+            campaigns = [campaign for campaign in campaigns if campaign in wanted]
+        per_customer = "FROM customer" in query
+        for day in _days(start, end):
+            rows = [
+                _Obj(
+                    segments=_Obj(date=day.isoformat()),
+                    metrics=_Obj(cost_micros=_value(customer_id, day, campaign) % 50_000_000),
+                    campaign=_Obj(id=campaign + 1, name=f"campaign-{campaign}")
+                )
+                for campaign in campaigns
+            ]
+            if per_customer:
+                rows = [_Obj(segments=_Obj(date=day.isoformat()),
+                             metrics=_Obj(cost_micros=sum(row.metrics.cost_micros for row in rows)))]
+            yield from rows
+
+    def search_stream(self, customer_id=None, query=None):
+        self.backend.call("gads.search_stream")
+        between = _BETWEEN.search(query)
+        if between:
+            rows = self._spend_rows(customer_id, query, *between.groups())
+        else:
+            rows = self._campaign_rows(customer_id, query)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == 10_000:
+                self.backend.served("gads", len(batch))
+                yield _Obj(results=batch)
+                batch = []
+        if batch:
+            self.backend.served("gads", len(batch))
+            yield _Obj(results=batch)
+
+    def search(self, customer_id=None, query=None):
+        for batch in self.search_stream(customer_id=customer_id, query=query):
+            yield from batch.results
+
+
+class FakeGoogleAdsClient:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get_service(self, name):
+        return FakeGoogleAdsService(self.backend)
+
+
+# --- GA4 --------------------------------------------------------------------
+
+class FakeAnalyticsClient:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _report(self, request):
+        property_id = request.property.split("/")[-1]
+        date_range = request.date_ranges[0]
+        metric_names = [m.name for m in request.metrics]
+        days = list(_days(date_range.start_date, date_range.end_date))
+        offset = request.offset or 0
+        limit = request.limit or len(days)
+        rows = []
+        for day in days[offset:offset + limit]:
+            values = []
+            for name in metric_names:
+                raw = _value(property_id, day, name)
+                values.append(_Obj(value=str(raw % 500) if name in _COUNT_METRICS else f"{raw % 100_000 / 100:.2f}"))
+            rows.append(_Obj(dimension_values=[_Obj(value=day.strftime("%Y%m%d"))], metric_values=values))
+        self.backend.served("ga4", len(rows))
+        quota = _Obj(tokens_per_hour=_Obj(consumed=0, remaining=40_000))
+        return _Obj(rows=rows, row_count=len(days), property_quota=quota)
+
+    def run_report(self, request):
+        self.backend.call("ga4.run_report")
+        return self._report(request)
+
+    def batch_run_reports(self, request):
+        self.backend.call("ga4.batch_run_reports")
+        return _Obj(reports=[self._report(r) for r in request.requests])
+
+
+# --- Sheets -----------------------------------------------------------------
+
+def _parse_range(cell_range):
+    # "A5:K9" / "'Tab'!D2:E2" -> (first column, first row, last column, last row), 1-based
+    first_col, first, last_col, last = _CELL_RANGE.search(cell_range).groups()
+
+    def number(letters):
+        n = 0
+        for letter in letters:
+            n = n * 26 + ord(letter) - ord("A") + 1
+        return n
+    return number(first_col), int(first), number(last_col or first_col), int(last or first)
+
+
+class FakeWorksheet:
+    def __init__(self, backend, spreadsheet, title):
+        self.backend = backend
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = len(spreadsheet.worksheets)
+        self.rows = []
+
+    def _last_row(self):
+        last = len(self.rows)
+        while last and not any(str(cell).strip() for cell in self.rows[last - 1]):
+            last -= 1
+        return last
+
+    def col_values(self, col):
+        self.backend.call("sheets.col_values")
+        values = [str(row[col - 1]) if len(row) >= col else "" for row in self.rows]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def get(self, cell_range, value_render_option=None):
+        self.backend.call("sheets.get")
+        first_col, first, last_col, last = _parse_range(cell_range)
+        values = []
+        for row in self.rows[first - 1:last]:
+            cells = row[first_col - 1:last_col]
+            if value_render_option != "UNFORMATTED_VALUE":
+                cells = [str(cell) for cell in cells]
+            # Like the API, trailing empty cells and rows are left out
+            while cells and cells[-1] in ("", None):
+                cells.pop()
+            values.append(cells)
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def batch_update(self, data, **kwargs):
+        self.backend.call("sheets.values_batch_update")
+        cells = 0
+        for item in data:
+            first_col, first, _, _ = _parse_range(item["range"])
+            for offset, values in enumerate(item["values"]):
+                while len(self.rows) < first + offset:
+                    self.rows.append([])
+                row = self.rows[first + offset - 1]
+                row.extend([""] * (first_col - 1 + len(values) - len(row)))
+                row[first_col - 1:first_col - 1 + len(values)] = values
+                cells += len(values)
+        self.backend.served("sheets", cells)
+        return {"totalUpdatedCells": cells}
+
+    def append_rows(self, rows, **kwargs):
+        self.backend.call("sheets.append_rows")
+        # Like values.append: blank rows after the table don't move its end
+        start = self._last_row() + 1
+        del self.rows[start - 1:]
+        self.rows.extend(list(row) for row in rows)
+        self.backend.served("sheets", len(rows))
+        return {"updates": {
+            "updatedRange": f"'{self.title}'!A{start}:Z{start + len(rows) - 1}",
+            "updatedRows": len(rows)
+        }}
+
+
+class FakeSpreadsheet:
+    def __init__(self, backend, sheet_id):
+        self.backend = backend
+        self.id = sheet_id
+        self.worksheets = {}
+
+    def batch_update(self, body):
+        self.backend.call("sheets.batch_update")
+        return {"replies": [{} for _ in body["requests"]]}
+
+    def worksheet(self, title):
+        self.backend.call("sheets.worksheet")
+        if title not in self.worksheets:
+            self.worksheets[title] = FakeWorksheet(self.backend, self, title)
+        return self.worksheets[title]
+
+
+class FakeSheetsClient:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def open_by_key(self, sheet_id):
+        self.backend.call("sheets.open_by_key")
+        with self.backend._lock:
+            if sheet_id not in self.backend.books:
+                self.backend.books[sheet_id] = FakeSpreadsheet(self.backend, sheet_id)
+            return self.backend.books[sheet_id]
+
+
+def install_fakes(backend):
+    """Route client_pool at the fakes; uninstall_fakes() restores the SDKs."""
+    client_pool.set_client_factory("gads", lambda gads_config, mcc_id=None: FakeGoogleAdsClient(backend))
+    client_pool.set_client_factory("ga4", lambda service_account_info: FakeAnalyticsClient(backend))
+    client_pool.set_client_factory("sheets", lambda service_account_info, scopes=None: FakeSheetsClient(backend))
+
+
+def uninstall_fakes():
+    for kind in ("gads", "ga4", "sheets"):
+        client_pool.set_client_factory(kind, None)
+
+
+# --- Harness ----------------------------------------------------------------
+
+def synthetic_configs(n_apps):
+    service_account_info = {
+        "type": "service_account",
+        "client_email": "bench@example.iam.gserviceaccount.com",
+        "private_key_id": "bench",
+        "private_key": "bench",
+        "token_uri": "https://oauth2.googleapis.com/token"
+    }
+    gads_credentials = {
+        "developer_token": "bench", "refresh_token": "bench",
+        "client_id": "bench", "client_secret": "bench", "mcc_id": "0"
+    }
+    return [
+        {
+            "app_name": f"App{i}",
+            "ga4": {"property_id": str(100000 + i), "service_account_info": service_account_info},
+            "gads": dict(gads_credentials, customer_id=str(200000 + i)),
+            # Read from the top level, like apps_config.json
+            "campaign_prefix": f"App{i}_",
+            "date_range_days": 2,
+            "sheets": {"sheet_id": "bench-warehouse", "sheet_name": f"App{i}WareHouse"},
+            "app_sheet": {"sheet_id": "bench-apps", "sheet_name": f"App{i}"}
+        }
+        for i in range(n_apps)
+    ]
+
+
+def _count_rows(all_apps_monthly_data):
+    return sum(len(rows) for months in all_apps_monthly_data.values() for rows in months.values())
+
+
+def _run_stage(backend, name, fn, verbose):
+    backend.reset_counters()
+    reset_metrics()
+    retries_before = scheduler.scheduler_stats()["retries"]
+    tracemalloc.reset_peak()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    started = time.perf_counter()
+    with output:
+        rows = fn()
+    wall = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    # The pipeline logs and carries on past per-app failures; count them here
+    errors = sum(c["value"] for c in run_summary()["counters"] if c["metric"] == "stage_errors")
+    return {
+        "stage": name,
+        "wall_s": round(wall, 3),
+        "api_calls": sum(backend.calls.values()),
+        "calls": dict(backend.calls),
+        "retries": scheduler.scheduler_stats()["retries"] - retries_before,
+        "errors": errors,
+        "rows": rows,
+        "rows_per_s": round(rows / wall, 1) if wall else 0.0,
+        "peak_mb": round(peak / 2 ** 20, 2)
+    }
+
+
+def run_scenario(n_apps, n_days, latency=0.02, error_rate=0.0, campaigns_per_day=5,
+                 stages=STAGES, verbose=False):
+    """Run the pipeline stages for n_apps apps with n_days of history; returns per-stage results."""
+    # Imported here so the fakes are in place before any client is built
+    from app_level_data import DEFAULT_RESTATEMENT_DAYS, append_new_unique_rows_all_apps
+    from backfill import backfill_all_apps
+    from cleaning import clean_ga4_data_all_apps
+    from fetch import fetch_ga4_data
+    from ga4_query import reset_property_cache
+
+    backend = FakeBackend(latency, error_rate, campaigns_per_day)
+    install_fakes(backend)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        config_file = os.path.join(workdir, "apps_config.json")
+        configs = synthetic_configs(n_apps)
+        with open(config_file, "w") as f:
+            json.dump(configs, f)
+        configure_store(os.path.join(workdir, "metrics_store.db"))
+        reset_campaign_id_cache()
+        # Every stage should reach the fake APIs, not an earlier stage's responses
+        configure_response_cache(MODE_OFF)
+        configure_index(os.path.join(workdir, "sheet_index.json"))
+
+        # History ends before the daily window so the daily stages have new rows to write
+        history_end = date.today() - timedelta(days=3)
+        history_start = history_end - timedelta(days=n_days - 1)
+        data = {}
+        history = {}
+
+        def _backfill():
+            history.update(backfill_all_apps(config_file, history_start, history_end))
+            append_new_unique_rows_all_apps(config_file, history)
+            return _count_rows(history)
+
+        def _clean():
+            data.update(clean_ga4_data_all_apps(config_file))
+            return _count_rows(data)
+
+        def _fetch_ga4_data():
+            reset_property_cache()
+            return sum(len(fetch_ga4_data(app_config)) for app_config in configs)
+
+        def _app_sheets():
+            append_new_unique_rows_all_apps(config_file, data)
+            return _count_rows(data)
+
+        def _warehouse():
+            from google_sheet import append_all_apps_to_sheets
+            append_all_apps_to_sheets(config_file, data)
+            return _count_rows(data)
+
+        def _local_warehouse():
+            from local_warehouse import sum_columns, write_all_apps_to_local
+            root = os.path.join(workdir, "warehouse")
+            write_all_apps_to_local(history, root)
+            write_all_apps_to_local(data, root)
+            # A portfolio-wide scan of everything just written
+            sum_columns(root=root)
+            return _count_rows(history) + _count_rows(data)
+
+        def _upsert():
+            # Restate the recent days with the default config; every restated
+            # row must keep its Ads spend (the fakes never report $0 for a day)
+            restated_dates = set()
+            for days_back in range(1, DEFAULT_RESTATEMENT_DAYS + 1):
+                d = date.today() - timedelta(days=days_back)
+                restated_dates.add(f"{d.day}-{d.month}-{d.year}")
+            upserted = clean_ga4_data_all_apps(config_file, upsert_days=DEFAULT_RESTATEMENT_DAYS)
+            append_new_unique_rows_all_apps(config_file, upserted, DEFAULT_RESTATEMENT_DAYS)
+            for app_config in configs:
+                worksheet = backend.books["bench-apps"].worksheets[app_config["app_sheet"]["sheet_name"]]
+                for row in worksheet.rows:
+                    if row and row[0] in restated_dates and not row[1]:
+                        print(f"{app_config['app_name']} {row[0]} was restated with $0 Ads spend")
+                        count("stage_errors", stage="upsert", app=app_config["app_name"])
+            return _count_rows(upserted)
+
+        stage_fns = {
+            "backfill": _backfill,
+            "clean": _clean,
+            "fetch_ga4_data": _fetch_ga4_data,
+            "app_sheets": _app_sheets,
+            "warehouse": _warehouse,
+            "local_warehouse": _local_warehouse,
+            "upsert": _upsert
+        }
+        tracemalloc.start()
+        try:
+            for name in STAGES:
+                if name in stages:
+                    result = _run_stage(backend, name, stage_fns[name], verbose)
+                    result.update(apps=n_apps, days=n_days)
+                    results.append(result)
+        finally:
+            tracemalloc.stop()
+            configure_store()
+            configure_index()
+            configure_response_cache()
+            uninstall_fakes()
+    return results
+
+
+def measure_startup(modules=STARTUP_MODULES, runs=5):
+    """Best-of-`runs` import time (ms) of `modules` in a fresh interpreter, plus heavy modules it loaded."""
+    script = (
+        "import sys, time\n"
+        "started = time.perf_counter()\n"
+        f"import {', '.join(modules)}\n"
+        "elapsed = (time.perf_counter() - started) * 1000\n"
+        f"heavy = sorted(m for m in sys.modules if m.startswith({HEAVY_MODULES!r}))\n"
+        "print(elapsed, ','.join(heavy))\n"
+    )
+    here = os.path.dirname(os.path.abspath(__file__))
+    best, heavy = None, []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", script], cwd=here, check=True,
+                                capture_output=True, text=True).stdout.split()
+        elapsed = float(output[0])
+        heavy = output[1].split(",") if len(output) > 1 else []
+        best = elapsed if best is None else min(best, elapsed)
+    return best, heavy
+
+
+def print_results(results, baseline=None):
+    previous = {(r["apps"], r["days"], r["stage"]): r for r in baseline or []}
+    print(f"{'apps':>5} {'days':>5} {'stage':<15} {'wall_s':>9} {'calls':>7} {'retries':>7} {'errors':>6} "
+          f"{'rows':>8} {'rows/s':>10} {'peak_mb':>8}")
+    for r in results:
+        line = (f"{r['apps']:>5} {r['days']:>5} {r['stage']:<15} {r['wall_s']:>9.3f} {r['api_calls']:>7} "
+                f"{r['retries']:>7} {r['errors']:>6} {r['rows']:>8} {r['rows_per_s']:>10.1f} {r['peak_mb']:>8.2f}")
+        before = previous.get((r["apps"], r["days"], r["stage"]))
+        if before and before["wall_s"]:
+            change = (r["wall_s"] - before["wall_s"]) / before["wall_s"] * 100
+            line += f"  {change:+.1f}% wall, {r['api_calls'] - before['api_calls']:+d} calls"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline against fake Google APIs.")
+    parser.add_argument("--apps", type=int, nargs="+", default=list(DEFAULT_APPS))
+    parser.add_argument("--days", type=int, nargs="+", default=list(DEFAULT_DAYS))
+    parser.add_argument("--latency", type=float, default=0.02, help="Mean seconds per fake API call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls failing with RESOURCE_EXHAUSTED")
+    parser.add_argument("--campaigns-per-day", type=int, default=5, help="Ads rows per customer per day")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--real-quotas", action="store_true",
+                        help="Keep the scheduler's production rate limits (default: unthrottled)")
+    parser.add_argument("--backoff-base", type=float, default=0.05, help="Retry backoff base in seconds")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Earlier --json output to diff against")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    parser.add_argument("--startup", action="store_true",
+                        help=f"Only check import time against the {STARTUP_BUDGET_MS} ms budget")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        elapsed, heavy = measure_startup()
+        print(f"Startup: {elapsed:.1f} ms (budget {STARTUP_BUDGET_MS} ms)")
+        if heavy:
+            print(f"SDK modules imported at startup: {', '.join(heavy)}")
+        if elapsed > STARTUP_BUDGET_MS or heavy:
+            raise SystemExit(1)
+        return
+
+    if not args.real_quotas:
+        for api in scheduler.DEFAULT_RATES:
+            scheduler.configure_rates(api, rate=1e9, burst=10 ** 6, scope_rate=1e9, scope_burst=10 ** 6)
+    scheduler.BACKOFF_BASE = args.backoff_base
+
+    results = []
+    for n_apps in args.apps:
+        for n_days in args.days:
+            results.extend(run_scenario(
+                n_apps, n_days, args.latency, args.error_rate, args.campaigns_per_day,
+                args.stages, args.verbose
+            ))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    # A stage that failed or wrote nothing didn't measure the pipeline
+    failed = [r for r in results if r["errors"] or not r["rows"]]
+    for r in failed:
+        print(f"Stage '{r['stage']}' ({r['apps']} apps, {r['days']} days) had {r['errors']} error(s) "
+              f"and handled {r['rows']} row(s); rerun with --verbose for details")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import json
+from collections import defaultdict
+from datetime import date, timedelta
+from campaign_ids import campaign_id_filter
+from client_pool import get_ga4_client, get_gads_service
+from concurrency import run_per_app
+from fetch_campaign_Gads import normalize_gads_date, stream_spend_micros
+from ga4_query import REVENUE_METRICS, PAGE_SIZE, iter_report_rows, run_report
+from records import DailyMetrics, day_ordinal, to_micros
+from scheduler import call_api
+from telemetry import export_metrics, stage
+
+# ROAS by campaign / country / platform. Both sources are streamed (paged GA4
+# reports, Ads search_stream) straight into per-(day, key) totals, then
+# joined on (day, key); raw responses are never held in memory.
+
+BREAKDOWNS = {
+    "campaign": {
+        "ga4_dimension": "sessionGoogleAdsCampaignName",
+        "gads_resource": "campaign",
+        "gads_field": "campaign.name"
+    },
+    "country": {
+        "ga4_dimension": "country",
+        "gads_resource": "geographic_view",
+        "gads_field": "geographic_view.country_criterion_id",
+        "gads_lookup": "geo_target_constant"
+    },
+    "platform": {
+        "ga4_dimension": "platform",
+        "gads_resource": "campaign",
+        "gads_field": "campaign.app_campaign_setting.app_store",
+        "gads_values": {"GOOGLE_APP_STORE": "Android", "APPLE_APP_STORE": "iOS"}
+    }
+}
+
+_geo_names = {}
+
+
+def breakdown_specs(app_config):
+    """
+    Breakdowns enabled for an app. "breakdowns" in the app config is a list
+    of names from BREAKDOWNS and/or dicts with the same keys plus "name".
+    """
+    specs = []
+    for entry in app_config.get("breakdowns") or []:
+        if isinstance(entry, str):
+            if entry not in BREAKDOWNS:
+                raise ValueError(f"Unknown breakdown '{entry}'. Known: {', '.join(BREAKDOWNS)}")
+            specs.append(dict(BREAKDOWNS[entry], name=entry))
+        else:
+            specs.append(dict(entry))
+    return specs
+
+
+def _field_value(row, path):
+    value = row
+    for part in path.split("."):
+        value = getattr(value, part)
+    # Enum fields (e.g. app_store) come back as enum members
+    return getattr(value, "name", value)
+
+
+def _resolve_geo_names(ga_service, customer_id, criterion_ids):
+    missing = [str(i) for i in criterion_ids if i not in _geo_names]
+    if missing:
+        query = (
+            "SELECT geo_target_constant.id, geo_target_constant.name FROM geo_target_constant "
+            f"WHERE geo_target_constant.id IN ({', '.join(missing)})"
+        )
+        rows = call_api("gads", lambda: list(ga_service.search(customer_id=customer_id, query=query)),
+                        scope=customer_id)
+        for row in rows:
+            _geo_names[int(row.geo_target_constant.id)] = row.geo_target_constant.name
+    return {i: _geo_names.get(i, str(i)) for i in criterion_ids}
+
+
+def stream_gads_breakdown(app_config, spec, start_date_str, end_date_str):
+    """{(day, key): spend_micros} folded from search_stream batches."""
+    gads_config = app_config.get("gads") or {}
+    customer_id = gads_config.get("customer_id")
+    if not customer_id or not spec.get("gads_field"):
+        return {}
+    ga_service = get_gads_service(gads_config)
+
+    field = spec["gads_field"]
+    where = [f"segments.date BETWEEN '{start_date_str}' AND '{end_date_str}'"]
+    campaign_filter = campaign_id_filter(ga_service, customer_id, app_config.get("campaign_prefix", ""))
+    if campaign_filter is None:
+        return {}
+    if campaign_filter:
+        where.append(campaign_filter)
+    query = (
+        f"SELECT {field}, segments.date, metrics.cost_micros "
+        f"FROM {spec.get('gads_resource', 'campaign')} WHERE {' AND '.join(where)}"
+    )
+
+    spend = stream_spend_micros(
+        ga_service, customer_id, query,
+        lambda row: (day_ordinal(normalize_gads_date(row.segments.date)), _field_value(row, field))
+    )
+
+    if spec.get("gads_lookup") == "geo_target_constant":
+        names = _resolve_geo_names(ga_service, customer_id, {key for _, key in spend})
+        renamed = defaultdict(int)
+        for (day, key), micros in spend.items():
+            renamed[(day, names[key])] += micros
+        spend = renamed
+    values = spec.get("gads_values") or {}
+    if values:
+        mapped = defaultdict(int)
+        for (day, key), micros in spend.items():
+            mapped[(day, values.get(key, key))] += micros
+        spend = mapped
+    return dict(spend)
+
+
+def stream_ga4_breakdown(app_config, spec, start_date_str, end_date_str):
+    """{(day, key): [revenue_micros, iap_micros, purchases]} from paged GA4 reports."""
+    ga4_config = app_config["ga4"]
+    client = get_ga4_client(ga4_config["service_account_info"])
+    property_id = ga4_config["property_id"]
+
+    from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, RunReportRequest
+
+    def _page(offset):
+        return RunReportRequest(
+            property=f"properties/{property_id}",
+            dimensions=[Dimension(name="date"), Dimension(name=spec["ga4_dimension"])],
+            metrics=[Metric(name=name) for name in REVENUE_METRICS],
+            date_ranges=[DateRange(start_date=start_date_str, end_date=end_date_str)],
+            offset=offset,
+            limit=PAGE_SIZE,
+            return_property_quota=True
+        )
+
+    first_report = run_report(client, property_id, _page(0))
+
+    totals = defaultdict(lambda: [0, 0, 0])
+    for row in iter_report_rows(client, first_report, _page, property_id):
+        key = (day_ordinal(row.dimension_values[0].value), row.dimension_values[1].value)
+        acc = totals[key]
+        acc[0] += to_micros(row.metric_values[0].value)
+        acc[1] += to_micros(row.metric_values[1].value)
+        acc[2] += int(row.metric_values[2].value or 0)
+    return dict(totals)
+
+
+def fetch_breakdown(app_config, spec, start_date_str, end_date_str):
+    """DailyMetrics per (day, key), joining GA4 revenue and Ads spend."""
+    revenue = stream_ga4_breakdown(app_config, spec, start_date_str, end_date_str)
+    spend = stream_gads_breakdown(app_config, spec, start_date_str, end_date_str)
+
+    joined = {}
+    for day, key in sorted(set(revenue) | set(spend), key=lambda k: (k[0], str(k[1]))):
+        total_revenue, iap_revenue, purchases = revenue.get((day, key), (0, 0, 0))
+        gads_spend = spend.get((day, key), 0)
+        joined[(day, key)] = DailyMetrics(
+            day,
+            gads_spend=gads_spend,
+            total_spend=gads_spend,
+            total_revenue=total_revenue,
+            iap_revenue=iap_revenue,
+            purchases=purchases
+        )
+    return joined
+
+
+def fetch_breakdowns(app_config, start_date_str, end_date_str):
+    breakdowns = {}
+    for spec in breakdown_specs(app_config):
+        with stage("breakdown", app=app_config.get("app_name", "Unnamed"), breakdown=spec["name"]):
+            breakdowns[spec["name"]] = fetch_breakdown(app_config, spec, start_date_str, end_date_str)
+    return breakdowns
+
+
+def print_breakdown_report(app_name, breakdowns):
+    for name, rows in breakdowns.items():
+        print(f"\n=== {app_name} by {name} ===")
+        print(f"Date\t{name}\tGads_Spend\tTotal New Revenue\tIAP_Revenue\tCount of Purchases\tROAS\tROI")
+        for (day, key), row in rows.items():
+            print(f"{row.formatted_date}\t{key}\t{row.cleaned('Gads_Spend')}\t{row.cleaned('Total New Revenue')}\t"
+                  f"{row.cleaned('IAP_Revenue')}\t{row.purchases}\t{row.roas}\t{row.roi}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ROAS by campaign, country or platform.")
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--config", default="apps_config.json")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        configs = [c for c in json.load(f) if c.get("breakdowns")]
+    end = date.today() - timedelta(days=1)
+    start = end - timedelta(days=args.days - 1)
+    results = run_per_app(configs, lambda c: fetch_breakdowns(c, start.isoformat(), end.isoformat()))
+    for app_config, breakdowns, error in results:
+        app_name = app_config.get("app_name", "Unnamed")
+        if error is not None:
+            print(f"Error fetching breakdowns for '{app_name}': {error}")
+            continue
+        print_breakdown_report(app_name, breakdowns)
+    export_metrics()
@@ -0,0 +1,148 @@
+import threading
+from datetime import datetime, timedelta
+from metrics_store import get_store
+from response_cache import MODE_REPLAY, cache_mode, cached_response, normalize_query
+from scheduler import call_api
+
+# campaign_prefix -> campaign IDs per customer, so spend queries filter on
+# campaign.id instead of scanning names with LIKE on every (campaign, day)
+# row. IDs are re-resolved after CAMPAIGN_ID_TTL, or sooner when the
+# account's change history shows a campaign change newer than the last one
+# seen (its last_change_date_time is kept with the IDs). The TTL is well
+# inside the store's unsettled window, so spend for a new campaign is
+# picked up before those days are settled.
+
+CAMPAIGN_ID_TTL = timedelta(hours=6)
+# change_status times are in the account's time zone; until a change has
+# been seen, look back this much before the lookup so an offset can't hide one
+CHANGE_LOOKBACK_SLACK = timedelta(days=1)
+# Don't ask for change history again within this long in one process
+CHANGE_CHECK_INTERVAL = timedelta(minutes=10)
+# campaign.id IN (...) lists are split to keep queries a sane size
+MAX_IDS_PER_QUERY = 1000
+
+_lock = threading.Lock()
+_memory = {}
+_checked = {}
+
+
+def _resolve(ga_service, customer_id, campaign_prefix, refresh=False):
+    query = f"SELECT campaign.id FROM campaign WHERE campaign.name LIKE '{campaign_prefix}%'"
+
+    def _search():
+        rows = call_api("gads", lambda: list(ga_service.search(customer_id=customer_id, query=query)),
+                        scope=customer_id)
+        return sorted({int(row.campaign.id) for row in rows})
+
+    return cached_response("gads", [customer_id, normalize_query(query)], _search, refresh=refresh)
+
+
+def _latest_campaign_change(ga_service, customer_id, after):
+    """
+    (changed, last_change): whether a campaign changed after `after` (a
+    change_status timestamp) and the newest change time, when known.
+    """
+    if cache_mode() == MODE_REPLAY:
+        # The lookup depends on the clock; a replay re-resolves from the recording
+        return True, None
+    query = (
+        "SELECT change_status.last_change_date_time FROM change_status "
+        "WHERE change_status.resource_type = 'CAMPAIGN' "
+        f"AND change_status.last_change_date_time > '{after}' "
+        "ORDER BY change_status.last_change_date_time DESC LIMIT 1"
+    )
+    try:
+        rows = call_api("gads", lambda: list(ga_service.search(customer_id=customer_id, query=query)),
+                        scope=customer_id)
+    except Exception as e:
+        # No change history (e.g. older than 90 days, or no access): resolve again
+        print(f"Could not read change history for customer {customer_id}: {e}")
+        return True, None
+    if not rows:
+        return False, None
+    return True, str(rows[0].change_status.last_change_date_time)
+
+
+def _cached(customer_id, campaign_prefix):
+    store = get_store()
+    if store is not None:
+        return store.campaign_ids(customer_id, campaign_prefix)
+    with _lock:
+        return _memory.get((str(customer_id), campaign_prefix))
+
+
+def _remember(customer_id, campaign_prefix, ids, resolved_at, last_change):
+    store = get_store()
+    if store is not None:
+        store.save_campaign_ids(customer_id, campaign_prefix, ids, resolved_at, last_change)
+    with _lock:
+        _memory[(str(customer_id), campaign_prefix)] = (ids, resolved_at, last_change)
+
+
+def resolve_campaign_ids(ga_service, customer_id, campaign_prefix, now=None):
+    """Sorted IDs of the customer's campaigns whose name starts with `campaign_prefix`."""
+    now = now or datetime.now()
+    key = (str(customer_id), campaign_prefix)
+    cached = _cached(customer_id, campaign_prefix)
+
+    last_change = None
+    if cached is not None:
+        ids, resolved_at, last_change = cached
+        if now - resolved_at < CAMPAIGN_ID_TTL:
+            with _lock:
+                recently_checked = now - _checked.get(key, datetime.min) < CHANGE_CHECK_INTERVAL
+            changed = False
+            if not recently_checked:
+                after = last_change or (resolved_at - CHANGE_LOOKBACK_SLACK).strftime("%Y-%m-%d %H:%M:%S")
+                changed, latest = _latest_campaign_change(ga_service, customer_id, after)
+                last_change = latest or last_change
+            if not changed:
+                with _lock:
+                    _checked[key] = now
+                return ids
+
+    # Cached IDs that expired or predate a change must not come back from
+    # the response cache; only a first lookup may reuse another run's answer
+    ids = _resolve(ga_service, customer_id, campaign_prefix, refresh=cached is not None)
+    _remember(customer_id, campaign_prefix, ids, now, last_change)
+    with _lock:
+        _checked[key] = now
+    return ids
+
+
+def gads_spend_queries(ga_service, customer_id, campaign_prefix, day_start, day_end):
+    """
+    GAQL queries whose rows sum to the daily spend of the prefix's
+    campaigns. Without a prefix the customer resource already sums spend
+    server-side, one row per day. An empty list means nothing matches.
+    """
+    date_filter = f"segments.date BETWEEN '{day_start}' AND '{day_end}'"
+    if not campaign_prefix:
+        return [f"SELECT segments.date, metrics.cost_micros FROM customer WHERE {date_filter}"]
+
+    ids = resolve_campaign_ids(ga_service, customer_id, campaign_prefix)
+    return [
+        "SELECT segments.date, metrics.cost_micros FROM campaign "
+        f"WHERE campaign.id IN ({', '.join(str(i) for i in ids[start:start + MAX_IDS_PER_QUERY])}) "
+        f"AND {date_filter}"
+        for start in range(0, len(ids), MAX_IDS_PER_QUERY)
+    ]
+
+
+def campaign_id_filter(ga_service, customer_id, campaign_prefix):
+    """WHERE clause restricting a query to the prefix's campaigns ("" without a prefix, None if none match)."""
+    if not campaign_prefix:
+        return ""
+    ids = resolve_campaign_ids(ga_service, customer_id, campaign_prefix)
+    if not ids:
+        return None
+    return f"campaign.id IN ({', '.join(str(i) for i in ids)})"
+
+
+def reset_campaign_id_cache():
+    with _lock:
+        _memory.clear()
+        _checked.clear()
+    store = get_store()
+    if store is not None:
+        store.reset_campaign_ids()
@@ -1,74 +1,123 @@
 import json
-from fetch import fetch_ga4_data
-from fetch_campaign_Gads import fetch_gads_data
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from fetch import REFILL_DAYS, combine_app_data, fetch_ga4_sources, ga4_fallback
+from fetch_campaign_Gads import fetch_gads_data_for_apps
 from collections import defaultdict
-
-def clean_ga4_data_all_apps(config_file="apps_config.json"):
+from concurrency import run_per_app, configure_limits, DEFAULT_MAX_WORKERS
+from client_pool import print_pool_stats
+from scheduler import print_scheduler_stats
+from telemetry import count, export_metrics, stage
+from ga4_query import reset_property_cache
+from rolling import indicator_columns
+from records import month_sort_key
+from run_journal import FETCH, get_journal, run_started_at
+
+def group_rows_by_month(rows, with_year=False):
+    # Rows stay typed DailyMetrics records; money/percent strings are
+    # produced by record.cleaned() where cells are written or printed.
+    # Multi-year ranges (backfills) label months as "October 2024".
+    monthly_data = defaultdict(list)
+    for row in rows:
+        monthly_data[row.month_with_year if with_year else row.month].append(row)
+    return monthly_data
+
+def clean_ga4_data_all_apps(config_file="apps_config.json", max_workers=DEFAULT_MAX_WORKERS,
+                            gads_limit=None, ga4_limit=None, sheets_limit=None, app_names=None,
+                            upsert_days=0):
     with open(config_file) as f:
         configs = json.load(f)
+    if app_names:
+        configs = [c for c in configs if c.get("app_name", "Unnamed") in set(app_names)]
+
+    configure_limits(gads=gads_limit, ga4=ga4_limit, sheets=sheets_limit)
+    reset_property_cache()
 
     all_apps_monthly_data = {}
 
+    # A journaled run that is resumed reuses what its apps already fetched
+    journal = get_journal()
+    journaled = journal.completed(FETCH) if journal else {}
+    today = run_started_at()
+    # Recent days are cleaned (and their Ads spend fetched) again every run:
+    # the writers add any a failed run skipped and upserts restate the rest
+    recent_days = max(upsert_days, REFILL_DAYS)
+    to_fetch = [c for c in configs if c.get("app_name", "Unnamed") not in journaled]
+
+    def _fetch_ga4(app_config):
+        with stage("ga4_fetch", app=app_config.get("app_name", "Unnamed")):
+            return fetch_ga4_sources(app_config, today)
+
+    # Ads (grouped by MCC and streamed) and GA4 (per app, in parallel) are
+    # fetched at the same time; ROAS/ROI are computed once both are in
+    fetched = {}
+    if to_fetch:
+        with ThreadPoolExecutor(max_workers=1) as gads_pool:
+            gads_future = gads_pool.submit(fetch_gads_data_for_apps, to_fetch, today=today,
+                                           recent_days=recent_days)
+            ga4_results = run_per_app(to_fetch, _fetch_ga4, max_workers)
+            gads_results = gads_future.result()
+        for (app_config, ga4_sources, fetch_error), gads_data in zip(ga4_results, gads_results):
+            app_name = app_config.get("app_name", "Unnamed")
+            fetched[app_name] = (ga4_sources, fetch_error, gads_data)
+            # Only a complete fetch is reused; a failed source is fetched again on resume
+            if journal and fetch_error is None and gads_data is not None:
+                journal.record(app_name, FETCH, {"ga4": ga4_sources, "gads": gads_data})
+    if journaled:
+        print(f"Reusing fetched data for {len(journaled)} app(s) from run '{journal.run_id}'")
+
     for app_config in configs:
         app_name = app_config.get("app_name", "Unnamed")
-        gads_data = fetch_gads_data(app_config)
-        ga4_data = fetch_ga4_data(app_config, gads_data)
+        if app_name in journaled:
+            payload = journaled[app_name]
+            ga4_sources, fetch_error, gads_data = payload["ga4"], None, payload["gads"]
+        else:
+            ga4_sources, fetch_error, gads_data = fetched[app_name]
+        if gads_data is None:
+            # Ads failed: GA4 revenue against $0 spend would stick, since dates
+            # already in the sheets aren't written again; a later run within
+            # REFILL_DAYS writes the day instead
+            print(f"Google Ads data unavailable, skipping {app_name} this run.")
+            continue
+        with stage("combine", app=app_name):
+            if fetch_error is None:
+                try:
+                    ga4_data = combine_app_data(app_config, ga4_sources, gads_data, today, recent_days)
+                except Exception as e:
+                    fetch_error = e
+            if fetch_error is not None:
+                ga4_data = ga4_fallback(app_config, gads_data, fetch_error, today)
 
         if not ga4_data:
             print(f"No GA4 data fetched for {app_name}.")
             continue
 
-        monthly_data = defaultdict(list)
-        for row in ga4_data:
-            date_obj = datetime.strptime(row['Formatted_Date'], '%d-%m-%Y')
-            month_name = date_obj.strftime('%B')
-
-            # Format monetary fields
-            def fmt_money(val):
-                return f"${round(float(val), 2)}" if isinstance(val, (int, float)) else "NA"
-
-            for col in ['Gads_Spend', 'Total_spend', 'Total New Revenue', 'Ad Revenue', 'IAP_Revenue']:
-                row[col] = fmt_money(row.get(col))
-
-            for col in ['Count of Purchases', 'Renewal', 'Renewal_Count']:
-                row[col] = int(row[col]) if isinstance(row[col], (int, float)) else 0
-
-            for col in ['ROAS', 'ROI', 'L3_ROAS', 'L7_ROAS', 'L14_ROAS', 'L3_ROI', 'L7_ROI', 'L14_ROI']:
-                row[col] = str(row[col]) if isinstance(row[col], (int, float)) else "N/A"
-
-            for col in ['ROAS_Indicator', 'ROI_Indicator']:
-                row[col] = str(row[col]) if row[col] is not None else "N/A"
-
-            row['Total Revenue'] = row['Total New Revenue']
-            row['__date_obj'] = date_obj
-
-            monthly_data[month_name].append(row)
-
-        all_apps_monthly_data[app_name] = monthly_data
+        with stage("clean", app=app_name):
+            all_apps_monthly_data[app_name] = group_rows_by_month(ga4_data)
+        count("rows", len(ga4_data), stage="clean", app=app_name)
 
     return all_apps_monthly_data
 
-def print_cleaned_data_grouped_all_apps(all_apps_monthly_data):
+def print_cleaned_data_grouped_all_apps(all_apps_monthly_data, app_config=None):
     columns = [
         "Formatted_Date", "Gads_Spend", "Total_spend", "Total New Revenue",
         "Ad Revenue", "IAP_Revenue", "Count of Purchases", "Renewal",
-        "Renewal_Count", "Total Revenue", "ROAS", "ROI", "L3_ROAS", 
-        "L7_ROAS", "L14_ROAS", "L3_ROI", "L7_ROI", "L14_ROI", 
-        "ROAS_Indicator", "ROI_Indicator"
-    ]
+        "Renewal_Count", "Total Revenue"
+    ] + indicator_columns(app_config)
 
     for app_name, monthly_data in all_apps_monthly_data.items():
         print(f"\n\n=== {app_name} ===")
-        for month in sorted(monthly_data, key=lambda m: datetime.strptime(m, "%B").month):
+        for month in sorted(monthly_data, key=month_sort_key):
             print(f"{month}\t" + "\t".join(columns[1:]))
-            sorted_rows = sorted(monthly_data[month], key=lambda r: r['__date_obj'])
+            sorted_rows = sorted(monthly_data[month], key=lambda r: r.day)
             for row in sorted_rows:
-                values = [row.get(col, "") for col in columns]
+                values = [row.cleaned(col) for col in columns]
                 print("\t".join(str(v) for v in values))
             print("\n")
 
 if __name__ == "__main__":
     all_data = clean_ga4_data_all_apps()
     if all_data:
-        print_cleaned_data_grouped_all_apps(all_data)
\ No newline at end of file
+        print_cleaned_data_grouped_all_apps(all_data)
+    print_pool_stats()
+    print_scheduler_stats()
+    export_metrics()
\ No newline at end of file
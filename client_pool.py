@@ -0,0 +1,213 @@
+import hashlib
+import json
+import threading
+from telemetry import stage
+
+# Process-wide registry of API clients. Apps that share credentials get the
+# same client back, so credential parsing, the gRPC channel / TLS handshake
+# and the OAuth token exchange are paid once per credential, not once per app.
+
+SHEETS_SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive"
+]
+GA4_SCOPES = ["https://www.googleapis.com/auth/analytics.readonly"]
+GADS_SCOPES = ["https://www.googleapis.com/auth/adwords"]
+# GA4 and Sheets clients on the same service account share one credential
+# (and so one access token) covering both
+SERVICE_ACCOUNT_SCOPES = GA4_SCOPES + SHEETS_SCOPES
+GOOGLE_TOKEN_URI = "https://oauth2.googleapis.com/token"
+
+GADS_CREDENTIAL_KEYS = ("developer_token", "refresh_token", "client_id", "client_secret")
+GADS_OAUTH_KEYS = ("refresh_token", "client_id", "client_secret")
+SERVICE_ACCOUNT_KEYS = ("client_email", "private_key_id", "private_key", "token_uri")
+
+
+def credential_fingerprint(info, keys=None):
+    """Stable sha256 of the identifying fields of a credential dict."""
+    if keys is not None:
+        info = {k: info.get(k) for k in keys}
+    payload = json.dumps(info, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Registry:
+    def __init__(self, kind):
+        self.kind = kind
+        self._items = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, factory):
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                return self._items[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Build outside the registry lock so different credentials don't
+        # wait on each other; the key lock stops duplicate builds
+        with key_lock:
+            with self._lock:
+                if key in self._items:
+                    self.hits += 1
+                    return self._items[key]
+            with stage("client_create", kind=self.kind):
+                item = factory()
+            with self._lock:
+                self._items[key] = item
+                self.misses += 1
+            return item
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._key_locks.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._items), "hits": self.hits, "misses": self.misses}
+
+
+_gads_clients = _Registry("gads")
+_gads_services = _Registry("gads_service")
+_ga4_clients = _Registry("ga4")
+_sheets_clients = _Registry("sheets")
+_credentials = _Registry("credentials")
+
+# Optional replacements for the real client builders, e.g. the in-process
+# fakes benchmark.py installs. Same arguments as the getters below.
+_factories = {}
+
+
+def set_client_factory(kind, factory=None):
+    """Build "gads", "ga4" or "sheets" clients with `factory`; None restores the real SDK."""
+    if kind not in ("gads", "ga4", "sheets"):
+        raise ValueError(f"Unknown client kind '{kind}'")
+    if factory is None:
+        _factories.pop(kind, None)
+    else:
+        _factories[kind] = factory
+    clear_pool()
+
+
+def _token_key(fingerprint, scopes):
+    return hashlib.sha256(f"{fingerprint}|{' '.join(sorted(scopes))}".encode("utf-8")).hexdigest()
+
+
+def get_service_account_credentials(service_account_info, scopes=None):
+    """
+    One parsed service-account credential per key and scope set, seeded
+    from and persisted to the token cache.
+    """
+    from token_cache import attach
+
+    scopes = list(scopes or SERVICE_ACCOUNT_SCOPES)
+    fingerprint = credential_fingerprint(service_account_info, SERVICE_ACCOUNT_KEYS)
+    key = ("service_account", fingerprint, tuple(sorted(scopes)))
+
+    def _build():
+        from google.oauth2.service_account import Credentials
+
+        creds = Credentials.from_service_account_info(service_account_info, scopes=scopes)
+        return attach(creds, _token_key(fingerprint, scopes), "service_account")
+
+    return _credentials.get(key, _build)
+
+
+def get_gads_credentials(gads_config):
+    """OAuth user credentials for the Ads refresh token, backed by the token cache."""
+    from token_cache import attach
+
+    fingerprint = credential_fingerprint(gads_config, GADS_OAUTH_KEYS)
+    key = ("gads", fingerprint)
+
+    def _build():
+        from google.oauth2.credentials import Credentials
+
+        creds = Credentials(
+            token=None,
+            refresh_token=gads_config["refresh_token"],
+            client_id=gads_config["client_id"],
+            client_secret=gads_config["client_secret"],
+            token_uri=GOOGLE_TOKEN_URI,
+            scopes=GADS_SCOPES
+        )
+        return attach(creds, _token_key(fingerprint, GADS_SCOPES), "gads")
+
+    return _credentials.get(key, _build)
+
+
+def get_gads_client(gads_config, mcc_id=None):
+    mcc_id = mcc_id or gads_config.get("mcc_id")
+    key = (credential_fingerprint(gads_config, GADS_CREDENTIAL_KEYS), str(mcc_id or ""))
+    factory = _factories.get("gads")
+    if factory is None:
+        from make_client import make_client
+
+        def factory(gads_config, mcc_id):
+            return make_client(gads_config, mcc_id, credentials=get_gads_credentials(gads_config))
+    return _gads_clients.get(key, lambda: factory(gads_config, mcc_id))
+
+
+def get_gads_service(gads_config, service_name="GoogleAdsService", mcc_id=None):
+    # Every get_service() call opens a new gRPC channel, so services are
+    # cached too; a hit here is a reused channel
+    client = get_gads_client(gads_config, mcc_id)
+    key = (id(client), service_name)
+    return _gads_services.get(key, lambda: client.get_service(service_name))
+
+
+def get_ga4_client(service_account_info):
+    key = credential_fingerprint(service_account_info, SERVICE_ACCOUNT_KEYS)
+    factory = _factories.get("ga4")
+    if factory is None:
+        from google.analytics.data_v1beta import BetaAnalyticsDataClient
+
+        def factory(service_account_info):
+            return BetaAnalyticsDataClient(credentials=get_service_account_credentials(service_account_info))
+    return _ga4_clients.get(key, lambda: factory(service_account_info))
+
+
+def get_sheets_client(service_account_info, scopes=None):
+    scopes = list(scopes or SHEETS_SCOPES)
+    key = (credential_fingerprint(service_account_info, SERVICE_ACCOUNT_KEYS), tuple(sorted(scopes)))
+
+    def _build():
+        factory = _factories.get("sheets")
+        if factory is not None:
+            return factory(service_account_info, scopes)
+        import gspread
+
+        # The shared GA4+Sheets credential covers the usual scopes; anything
+        # else gets a credential of its own
+        shared = set(scopes) <= set(SERVICE_ACCOUNT_SCOPES)
+        creds = get_service_account_credentials(service_account_info, None if shared else scopes)
+        return gspread.authorize(creds)
+
+    return _sheets_clients.get(key, _build)
+
+
+def pool_stats():
+    """Hit/miss counts per client kind; gads_service hits are reused gRPC channels."""
+    return {
+        "gads": _gads_clients.stats(),
+        "gads_service": _gads_services.stats(),
+        "ga4": _ga4_clients.stats(),
+        "sheets": _sheets_clients.stats(),
+        "credentials": _credentials.stats()
+    }
+
+
+def print_pool_stats():
+    for kind, stats in pool_stats().items():
+        print(f"{kind}: {stats['size']} client(s), {stats['hits']} hit(s), {stats['misses']} miss(es)")
+
+
+def clear_pool():
+    for registry in (_gads_clients, _gads_services, _ga4_clients, _sheets_clients, _credentials):
+        registry.clear()
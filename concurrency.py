@@ -0,0 +1,77 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Max number of in-flight calls per API, shared by every worker thread
+DEFAULT_LIMITS = {
+    "gads": 4,
+    "ga4": 8,
+    "sheets": 2
+}
+
+DEFAULT_MAX_WORKERS = 8
+
+_limits = dict(DEFAULT_LIMITS)
+_semaphores = {}
+_lock = threading.Lock()
+
+
+def configure_limits(**limits):
+    """Override per-API caps, e.g. configure_limits(gads=2, sheets=1)."""
+    with _lock:
+        for api, limit in limits.items():
+            if limit is None:
+                continue
+            if int(limit) < 1:
+                raise ValueError(f"Concurrency limit for '{api}' must be at least 1.")
+            _limits[api] = int(limit)
+            _semaphores.pop(api, None)
+
+
+def get_limit(api):
+    with _lock:
+        return _limits.get(api, 1)
+
+
+def _semaphore(api):
+    with _lock:
+        sem = _semaphores.get(api)
+        if sem is None:
+            sem = threading.BoundedSemaphore(_limits.get(api, 1))
+            _semaphores[api] = sem
+        return sem
+
+
+@contextmanager
+def api_slot(api):
+    """Hold one of the concurrency slots of `api` ("gads", "ga4", "sheets")."""
+    sem = _semaphore(api)
+    sem.acquire()
+    try:
+        yield
+    finally:
+        sem.release()
+
+
+def run_per_app(configs, worker, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Run worker(app_config) for every config on a thread pool.
+
+    Returns a list of (app_config, result, error) tuples in the same order as
+    `configs`. An exception in one app is captured in its tuple and never
+    affects the other apps.
+    """
+    def _safe(app_config):
+        try:
+            return app_config, worker(app_config), None
+        except Exception as e:
+            return app_config, None, e
+
+    configs = list(configs)
+    if not configs:
+        return []
+    workers = max(1, min(max_workers or 1, len(configs)))
+    if workers == 1:
+        return [_safe(app_config) for app_config in configs]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_safe, configs))
@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+import signal
+import tempfile
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from client_pool import clear_pool, get_ga4_client, get_gads_client, get_sheets_client
+from telemetry import export_metrics, reset_metrics, stage
+
+# Long-running mode: keeps the SDK imports and API clients warm between
+# runs, runs the pipeline on a schedule and picks up apps_config.json
+# changes before each run.
+#
+#   python daemon.py --interval 3600
+#   python daemon.py --daily-at 06:30 --write both
+
+DEFAULT_INTERVAL = 3600
+CONFIG_POLL_SECONDS = 30
+
+
+def warm_up(configs):
+    """Import the SDKs and build every app's clients ahead of the first run."""
+    for app_config in configs:
+        app_name = app_config.get("app_name", "Unnamed")
+        try:
+            if app_config.get("gads"):
+                get_gads_client(app_config["gads"])
+            service_account_info = app_config.get("ga4", {}).get("service_account_info")
+            if service_account_info:
+                get_ga4_client(service_account_info)
+                get_sheets_client(service_account_info)
+        except Exception as e:
+            print(f"Could not warm up clients for '{app_name}': {e}")
+
+
+def load_config(config_file):
+    """The parsed config, or None if it is missing or not valid JSON."""
+    try:
+        with open(config_file) as f:
+            configs = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Cannot read {config_file}: {e}")
+        return None
+    if not isinstance(configs, list):
+        print(f"{config_file} must contain a list of app configurations.")
+        return None
+    return configs
+
+
+def run_pipeline(config_file, write="both", local_warehouse=None, upsert_days=0):
+    from cleaning import clean_ga4_data_all_apps
+
+    reset_metrics()
+    with stage("pipeline"):
+        all_apps_monthly_data = clean_ga4_data_all_apps(config_file, upsert_days=upsert_days)
+        if write in ("app", "both"):
+            from app_level_data import append_new_unique_rows_all_apps
+            append_new_unique_rows_all_apps(config_file, all_apps_monthly_data, upsert_days)
+        if write in ("warehouse", "both"):
+            from google_sheet import append_all_apps_to_sheets
+            append_all_apps_to_sheets(config_file, all_apps_monthly_data)
+        if local_warehouse:
+            from local_warehouse import write_all_apps_to_local
+            write_all_apps_to_local(all_apps_monthly_data, local_warehouse)
+    export_metrics()
+
+
+def next_run_time(now, interval=DEFAULT_INTERVAL, daily_at=None):
+    if daily_at is None:
+        return now + timedelta(seconds=interval)
+    hour, minute = (int(part) for part in daily_at.split(":"))
+    run_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if run_at <= now:
+        run_at += timedelta(days=1)
+    return run_at
+
+
+class PipelineDaemon:
+    def __init__(self, config_file="apps_config.json", interval=DEFAULT_INTERVAL, daily_at=None,
+                 write="both", run_now=True, local_warehouse=None, upsert_days=0):
+        self.config_file = config_file
+        self.interval = interval
+        self.daily_at = daily_at
+        self.write = write
+        self.run_now = run_now
+        self.local_warehouse = local_warehouse
+        self.upsert_days = upsert_days
+        self._stop = threading.Event()
+        self._config_mtime = None
+        # Runs read this copy of the last valid config, so an edit made
+        # mid-run can't give the stages different views of it
+        self._snapshot = None
+
+    def stop(self, *_):
+        print("Stopping after the current run...")
+        self._stop.set()
+
+    def _config_changed(self):
+        try:
+            mtime = os.stat(self.config_file).st_mtime_ns
+        except OSError:
+            return False
+        changed = self._config_mtime is not None and mtime != self._config_mtime
+        self._config_mtime = mtime
+        return changed
+
+    def _reload(self):
+        configs = load_config(self.config_file)
+        if configs is None:
+            if self._snapshot:
+                print("Keeping the previous configuration")
+            return
+        if self._snapshot is None:
+            fd, self._snapshot = tempfile.mkstemp(prefix=".apps_config.", suffix=".json",
+                                                  dir=os.path.dirname(os.path.abspath(self.config_file)))
+            os.close(fd)
+        with open(self._snapshot, "w") as f:
+            json.dump(configs, f)
+        # Credentials may have changed; old clients are dropped and rebuilt
+        clear_pool()
+        warm_up(configs)
+        print(f"Loaded {len(configs)} app(s) from {self.config_file}")
+
+    def _run_once(self):
+        started = time.perf_counter()
+        try:
+            run_pipeline(self._snapshot, self.write, self.local_warehouse, self.upsert_days)
+            print(f"Run finished in {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            print(f"Run failed: {e}")
+            traceback.print_exc()
+
+    def serve(self):
+        self._config_changed()
+        self._reload()
+        next_run = datetime.now() if self.run_now else next_run_time(datetime.now(), self.interval, self.daily_at)
+        print(f"Next run at {next_run:%Y-%m-%d %H:%M:%S}")
+
+        while not self._stop.is_set():
+            if self._config_changed():
+                print(f"{self.config_file} changed, reloading")
+                self._reload()
+            if datetime.now() >= next_run:
+                if self._snapshot:
+                    self._run_once()
+                else:
+                    print(f"Skipping run until {self.config_file} is valid")
+                next_run = next_run_time(datetime.now(), self.interval, self.daily_at)
+                print(f"Next run at {next_run:%Y-%m-%d %H:%M:%S}")
+            wait = min(CONFIG_POLL_SECONDS, max((next_run - datetime.now()).total_seconds(), 0))
+            self._stop.wait(wait)
+
+        if self._snapshot:
+            os.remove(self._snapshot)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the pipeline on a schedule with warm clients.")
+    parser.add_argument("--config", default="apps_config.json")
+    schedule = parser.add_mutually_exclusive_group()
+    schedule.add_argument("--interval", type=int, default=DEFAULT_INTERVAL, help="Seconds between runs")
+    schedule.add_argument("--daily-at", help="Run once a day at HH:MM instead")
+    parser.add_argument("--write", choices=["none", "app", "warehouse", "both"], default="both")
+    parser.add_argument("--local-warehouse", metavar="DIR",
+                        help="Also write the cleaned rows to a local columnar warehouse in DIR")
+    parser.add_argument("--upsert-days", type=int, default=0,
+                        help="Fix app sheet rows from the last N days in place when the numbers changed")
+    parser.add_argument("--no-run-now", dest="run_now", action="store_false",
+                        help="Wait for the first scheduled time instead of running at startup")
+    args = parser.parse_args(argv)
+
+    daemon = PipelineDaemon(args.config, args.interval, args.daily_at, args.write, args.run_now,
+                            args.local_warehouse, args.upsert_days)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import heapq
+from itertools import groupby
+from operator import itemgetter
+from records import DailyMetrics, day_ordinal, to_micros
+
+# Sorted merge-join of daily sources on the integer day ordinal (or any
+# orderable key, e.g. (day, campaign)). Each source is one adapter: its rows
+# keyed once by ordinal, plus the record fields it fills and what to do on
+# days it has no row for. Fields filled by several sources are summed, so a
+# second spend source only needs its own adapter.
+
+# Missing-value policies
+MISSING_ZERO = "zero"    # use the column default
+MISSING_CARRY = "carry"  # repeat the source's last seen value
+MISSING_NONE = "none"    # leave the field as None
+
+
+class Column:
+    __slots__ = ("field", "key", "convert", "missing", "default")
+
+    def __init__(self, field, key=None, convert=None, missing=MISSING_ZERO, default=0):
+        if missing not in (MISSING_ZERO, MISSING_CARRY, MISSING_NONE):
+            raise ValueError(f"Unknown missing-value policy '{missing}'")
+        self.field = field
+        self.key = key or field
+        self.convert = convert
+        self.missing = missing
+        self.default = default
+
+
+class Source:
+    """
+    One input to the join. `rows` maps join key -> row dict. Only sources
+    with drives=True create output days; the others just fill in days that
+    exist anyway (e.g. renewals only annotate revenue/spend days).
+    """
+    __slots__ = ("name", "rows", "columns", "drives")
+
+    def __init__(self, name, rows, columns, drives=True):
+        self.name = name
+        self.rows = rows
+        self.columns = columns
+        self.drives = drives
+
+
+def _source_stream(index, source):
+    # Sources usually arrive in date order already, so this sort is linear
+    for key in sorted(source.rows):
+        yield key, index, source.rows[key]
+
+
+def merge_join(sources, fill_keys=()):
+    """
+    Yield (key, fields) in key order for every key present in a driving
+    source. If none of them has any rows, the join is redone with
+    `fill_keys` as the only driving keys.
+    """
+    sources = list(sources)
+    carried = [{} for _ in sources]
+    emitted = False
+
+    merged = heapq.merge(*(_source_stream(i, s) for i, s in enumerate(sources)), key=itemgetter(0))
+    for key, group in groupby(merged, key=itemgetter(0)):
+        present = {index: row for _, index, row in group}
+        if not any(sources[index].drives for index in present):
+            for index, row in present.items():
+                _carry(sources[index], row, carried[index])
+            continue
+        emitted = True
+        yield key, _fields(sources, present, carried)
+
+    if not emitted and fill_keys:
+        yield from merge_join(sources + [Source("fill", dict.fromkeys(fill_keys, {}), [])])
+
+
+def _value(column, row):
+    value = row.get(column.key)
+    if value is None:
+        return None
+    return column.convert(value) if column.convert else value
+
+
+def _carry(source, row, carried):
+    for column in source.columns:
+        if column.missing == MISSING_CARRY:
+            value = _value(column, row)
+            if value is not None:
+                carried[column.field] = value
+
+
+def _fields(sources, present, carried):
+    fields = {}
+    for index, source in enumerate(sources):
+        row = present.get(index)
+        for column in source.columns:
+            value = _value(column, row) if row is not None else None
+            if value is None:
+                if column.missing == MISSING_ZERO:
+                    value = column.default
+                elif column.missing == MISSING_CARRY:
+                    value = carried[index].get(column.field, column.default)
+            elif column.missing == MISSING_CARRY:
+                carried[index][column.field] = value
+
+            previous = fields.get(column.field)
+            if previous is not None and value is not None:
+                value = previous + value
+            elif value is None:
+                value = previous
+            fields[column.field] = value
+    return fields
+
+
+def by_ordinal(daily):
+    """{YYYY-MM-DD or YYYYMMDD: row} -> {day ordinal: row}; dates are parsed exactly once."""
+    return {day_ordinal(date_str): row for date_str, row in daily.items()}
+
+
+# --- Adapters for the pipeline's sources --------------------------------------
+
+def _int(value):
+    return int(value or 0)
+
+
+def gads_source(gads_data):
+    """Ads spend, {date: dollars}."""
+    return Source(
+        "gads",
+        {day: {"spend": spend} for day, spend in by_ordinal(gads_data).items()},
+        [Column("gads_spend", "spend", to_micros), Column("total_spend", "spend", to_micros)]
+    )
+
+
+def ga4_revenue_source(ga4_data_lookup):
+    """GA4 revenue report rows from ga4_query.parse_revenue_rows."""
+    return Source("ga4", by_ordinal(ga4_data_lookup), [
+        Column("total_revenue", "total_revenue", to_micros),
+        Column("iap_revenue", "iap_revenue", to_micros),
+        Column("purchases", "count_of_purchases", _int)
+    ])
+
+
+def renewal_source(renewal_data):
+    """GA4 purchase-event renewals; only annotates days other sources have."""
+    return Source("ga4_renewal", by_ordinal(renewal_data), [
+        Column("renewal", "Renewal", _int),
+        Column("renewal_count", "Renewal_Count", _int)
+    ], drives=False)
+
+
+def join_daily_records(sources, start_day, end_day):
+    """DailyMetrics per joined day, oldest first; a zero row per day in range if no source has data."""
+    return [
+        DailyMetrics(day, **fields)
+        for day, fields in merge_join(sources, range(start_day, end_day + 1))
+    ]
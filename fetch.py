@@ -2,11 +2,20 @@ import json
 import base64
 import tempfile
 import os
-from datetime import datetime, timedelta
+from datetime import date, datetime, time, timedelta
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from fetch_campaign_Gads import fetch_gads_data
-from google.analytics.data_v1beta import BetaAnalyticsDataClient
-from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, RunReportRequest
+from client_pool import get_ga4_client
+from ga4_query import fetch_property_metrics
+from metrics_store import fetch_with_history
+from daily_join import ga4_revenue_source, gads_source, join_daily_records, renewal_source
+from records import DailyMetrics, to_micros
+from scheduler import is_retryable
+from rolling import (
+    apply_rolling_metrics, indicator_columns, placeholder_rolling_values,
+    rolling_metrics, rolling_windows, history_days, DEFAULT_METRICS, DEFAULT_WINDOWS
+)
 
 def fix_base64_padding(data):
     if isinstance(data, str):
@@ -49,291 +58,162 @@ def validate_and_fix_service_account_info(ga4_config):
         print(f"Error validating service account info: {e}")
         raise
 
-def fetch_ga4_data(app_config, gads_data=None):
-    try:
-        ga4_config = app_config["ga4"]
-        service_account_info = ga4_config["service_account_info"]
-        PROPERTY_ID = ga4_config["property_id"]
-        client = BetaAnalyticsDataClient.from_service_account_info(service_account_info)
-
-        today = datetime.today()
-        start_date = today - timedelta(days=16)
-        end_date = today - timedelta(days=1)
-        start_date_str = start_date.strftime('%Y-%m-%d')
-        end_date_str = end_date.strftime('%Y-%m-%d')
-
-        request = RunReportRequest(
-            property=f"properties/{PROPERTY_ID}",
-            dimensions=[Dimension(name="date")],
-            metrics=[
-                Metric(name="totalRevenue"),
-                Metric(name="purchaseRevenue"),
-                Metric(name="transactions")
-            ],
-            date_ranges=[DateRange(start_date=start_date_str, end_date=end_date_str)]
-        )
-        response = client.run_report(request)
-
-        renewal_request = RunReportRequest(
-            property=f"properties/{PROPERTY_ID}",
-            dimensions=[Dimension(name="date")],
-            metrics=[
-                Metric(name="eventCount"),
-                Metric(name="totalUsers")
-            ],
-            date_ranges=[DateRange(start_date=start_date_str, end_date=end_date_str)],
-            dimension_filter={
-                'filter': {
-                    'field_name': 'eventName',
-                    'string_filter': {'value': 'purchase'}
-                }
-            }
-        )
-        renewal_response = client.run_report(renewal_request)
-
-        renewal_data = {}
-        for row in renewal_response.rows:
-            raw_date = row.dimension_values[0].value
-            date_str = datetime.strptime(raw_date, "%Y%m%d").strftime("%Y-%m-%d")
-            renewal_count = int(row.metric_values[0].value or 0)
-            renewal = int(row.metric_values[1].value or 0)
-            renewal_data[date_str] = {
-                "Renewal": renewal,
-                "Renewal_Count": renewal_count
-            }
-
-        # ✅ Create a set of all dates we need to process (from both GA4 and Google Ads)
-        all_dates = set()
-        gads_data = gads_data or {}
-        
-        # Add dates from GA4 data
-        for row in response.rows:
-            raw_date = row.dimension_values[0].value
-            date_obj = datetime.strptime(raw_date, "%Y%m%d")
-            all_dates.add(date_obj)
-        
-        # Add dates from Google Ads data
-        for date_str in gads_data.keys():
-            date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-            all_dates.add(date_obj)
-        
-        # If no data from either source, create date range
-        if not all_dates:
-            current_date = start_date
-            while current_date <= end_date:
-                all_dates.add(current_date)
-                current_date += timedelta(days=1)
-
-        # ✅ Create GA4 data lookup
-        ga4_data_lookup = {}
-        for row in response.rows:
-            raw_date = row.dimension_values[0].value
-            date_obj = datetime.strptime(raw_date, "%Y%m%d")
-            date_str = date_obj.strftime("%Y-%m-%d")
-            
-            total_revenue = float(row.metric_values[0].value or 0.0)
-            iap_revenue = float(row.metric_values[1].value or 0.0)
-            count_of_purchases = int(row.metric_values[2].value or 0)
-            
-            ga4_data_lookup[date_str] = {
-                "total_revenue": total_revenue,
-                "iap_revenue": iap_revenue,
-                "count_of_purchases": count_of_purchases
-            }
-
-        all_data = []
-
-        # ✅ Process all dates (both GA4 and Google Ads dates)
-        for date_obj in sorted(all_dates):
-            date_str = date_obj.strftime("%Y-%m-%d")
-            formatted_date = f"{date_obj.day}-{date_obj.month}-{date_obj.year}"
-
-            # Get GA4 data (or use zeros if not available)
-            ga4_row = ga4_data_lookup.get(date_str, {
-                "total_revenue": 0.0,
-                "iap_revenue": 0.0,
-                "count_of_purchases": 0
-            })
-            
-            total_revenue = ga4_row["total_revenue"]
-            iap_revenue = ga4_row["iap_revenue"]
-            count_of_purchases = ga4_row["count_of_purchases"]
-
-            # Get renewal data
-            renewal = renewal_data.get(date_str, {}).get("Renewal", 0)
-            renewal_count = renewal_data.get(date_str, {}).get("Renewal_Count", 0)
-
-            # ✅ Get Google Ads spend (preserve actual values, don't default to 0)
-            gads_spend = gads_data.get(date_str, 0.0)
-            total_spend = gads_spend if gads_spend is not None else 0.0
-
-            ad_revenue = total_revenue - iap_revenue
-            roas = round(total_revenue / total_spend, 2) if total_spend and total_spend > 0 else 0
-            roi = round((total_revenue - total_spend) / total_spend, 2) if total_spend and total_spend > 0 else 0
-
-            # ✅ Add row with all data (including Google Ads spend)
-            all_data.append({
-                "date_obj": date_obj,
-                "date_str": date_str,
-                "Formatted_Date": formatted_date,
-                "Month": date_obj.strftime("%B"),
-                "Gads_Spend": gads_spend if gads_spend else 0.0,
-                "Total_spend": total_spend if total_spend else 0.0,
-                "Total New Revenue": total_revenue if total_revenue else 0.0,
-                "Ad Revenue": ad_revenue if ad_revenue else 0.0,
-                "IAP_Revenue": iap_revenue if iap_revenue else 0.0,
-                "Count of Purchases": count_of_purchases if count_of_purchases else 0,
-                "Renewal": renewal if renewal else 0,
-                "Renewal_Count": renewal_count if renewal_count else 0,
-                "ROAS": roas if roas else 0,
-                "ROI": roi if roi else 0
-            })
-
-        all_data.sort(key=lambda x: x["date_obj"])
-
-        for i, row in enumerate(all_data):
-            l3_roas, l7_roas, l14_roas = calculate_averages(all_data, i, "ROAS")
-            l3_roi, l7_roi, l14_roi = calculate_averages(all_data, i, "ROI")
-            roas_indicator = calculate_simple_indicator(all_data, i, "ROAS")
-            roi_indicator = calculate_simple_indicator(all_data, i, "ROI")
-            row.update({
-                "L3_ROAS": l3_roas,
-                "L7_ROAS": l7_roas,
-                "L14_ROAS": l14_roas,
-                "L3_ROI": l3_roi,
-                "L7_ROI": l7_roi,
-                "L14_ROI": l14_roi,
-                "ROAS_Indicator": roas_indicator,
-                "ROI_Indicator": roi_indicator
-            })
-
-        display_start_date = today - timedelta(days=2)
-        display_end_date = today - timedelta(days=1)
-
-        enhanced_data = [row for row in all_data if display_start_date <= row["date_obj"] <= display_end_date]
-
-        # ✅ If no rows in display range, create them but preserve Google Ads data
-        if not enhanced_data:
-            for i in range(2, 0, -1):
-                d = today - timedelta(days=i)
-                date_str = d.strftime("%Y-%m-%d")
-                
-                # ✅ Check if there's Google Ads data for this date
-                gads_spend_for_date = gads_data.get(date_str, 0.0)
-                
-                enhanced_data.append({
-                    "date_obj": d,
-                    "date_str": date_str,
-                    "Formatted_Date": f"{d.day}-{d.month}-{d.year}",
-                    "Month": d.strftime("%B"),
-                    "Gads_Spend": gads_spend_for_date,  # ✅ Preserve actual Google Ads spend
-                    "Total_spend": gads_spend_for_date,  # ✅ Preserve actual Google Ads spend
-                    "Total New Revenue": 0.0,
-                    "Ad Revenue": 0.0,
-                    "IAP_Revenue": 0.0,
-                    "Count of Purchases": 0,
-                    "Renewal": 0,
-                    "Renewal_Count": 0,
-                    "ROAS": 0,
-                    "ROI": 0,
-                    "L3_ROAS": 0,
-                    "L7_ROAS": 0,
-                    "L14_ROAS": 0,
-                    "L3_ROI": 0,
-                    "L7_ROI": 0,
-                    "L14_ROI": 0,
-                    "ROAS_Indicator": "N/A",
-                    "ROI_Indicator": "N/A"
-                })
-
-        return enhanced_data
-
-    except Exception as e:
-        print(f"Error in fetch_ga4_data: {e}")
-        
-        # ✅ Even when GA4 fails, return data with Google Ads spend if available
-        if gads_data:
-            print(f"GA4 failed but Google Ads data available, creating fallback data...")
-            today = datetime.today()
-            fallback_data = []
-            
-            display_start_date = today - timedelta(days=2)
-            display_end_date = today - timedelta(days=1)
-            
-            current_date = display_start_date
-            while current_date <= display_end_date:
-                date_str = current_date.strftime("%Y-%m-%d")
-                gads_spend_for_date = gads_data.get(date_str, 0.0)
-                
-                fallback_data.append({
-                    "date_obj": current_date,
-                    "date_str": date_str,
-                    "Formatted_Date": f"{current_date.day}-{current_date.month}-{current_date.year}",
-                    "Month": current_date.strftime("%B"),
-                    "Gads_Spend": gads_spend_for_date,
-                    "Total_spend": gads_spend_for_date,
-                    "Total New Revenue": 0.0,
-                    "Ad Revenue": 0.0,
-                    "IAP_Revenue": 0.0,
-                    "Count of Purchases": 0,
-                    "Renewal": 0,
-                    "Renewal_Count": 0,
-                    "ROAS": 0,
-                    "ROI": 0,
-                    "L3_ROAS": 0,
-                    "L7_ROAS": 0,
-                    "L14_ROAS": 0,
-                    "L3_ROI": 0,
-                    "L7_ROI": 0,
-                    "L14_ROI": 0,
-                    "ROAS_Indicator": "N/A",
-                    "ROI_Indicator": "N/A"
-                })
-                
-                current_date += timedelta(days=1)
-            
-            return fallback_data
-        
+# Days back every cleaning run re-cleans, so the writers (which skip dates
+# already in a sheet) fill in a day an earlier run skipped after a failure
+REFILL_DAYS = 3
+
+def history_window(app_config, today):
+    """(start, end) datetimes of the days an app's rolling metrics need."""
+    windows = rolling_windows(app_config)
+    return today - timedelta(days=history_days(windows)), today - timedelta(days=1)
+
+def fetch_ga4_sources(app_config, today=None):
+    """
+    (ga4_data_lookup, renewal_data) for the app's history window, keyed by
+    YYYY-MM-DD. Independent of Ads, so both can be fetched at the same time;
+    errors are raised for ga4_fallback() to handle.
+    """
+    ga4_config = app_config["ga4"]
+    service_account_info = ga4_config["service_account_info"]
+    PROPERTY_ID = ga4_config["property_id"]
+    client = get_ga4_client(service_account_info)
+
+    today = today or datetime.today()
+    start_date, end_date = history_window(app_config, today)
+    start_date_str = start_date.strftime('%Y-%m-%d')
+    end_date_str = end_date.strftime('%Y-%m-%d')
+
+    # Settled days come from the local store; only the tail is queried.
+    # Revenue and renewal reports go out in one batched call per property
+    return fetch_with_history(
+        app_config.get("app_name", "Unnamed"), ("ga4", "ga4_renewal"),
+        start_date_str, end_date_str,
+        lambda fetch_start, fetch_end: fetch_property_metrics(client, PROPERTY_ID, fetch_start, fetch_end),
+        today
+    )
+
+def combine_app_data(app_config, ga4_sources, gads_data=None, today=None, recent_days=0):
+    """
+    Join fetched GA4 sources with Ads spend, compute ROAS/ROI and keep the
+    display days, widened to the last `recent_days` days (see display_days).
+    """
+    ga4_data_lookup, renewal_data = ga4_sources
+    windows = rolling_windows(app_config)
+    metrics = rolling_metrics(app_config)
+
+    today = today or datetime.today()
+    start_date, end_date = history_window(app_config, today)
+
+    gads_data = gads_data or {}
+    all_data = build_daily_records(
+        ga4_data_lookup, renewal_data, gads_data,
+        start_date.toordinal(), end_date.toordinal(), metrics, windows
+    )
+
+    display_start_day, display_end_day = display_days(today, recent_days)
+
+    enhanced_data = [row for row in all_data if display_start_day <= row.day <= display_end_day]
+
+    # ✅ If no rows in display range, create them but preserve Google Ads data
+    if not enhanced_data:
+        for i in range(2, 0, -1):
+            day = (today - timedelta(days=i)).toordinal()
+            # ✅ Preserve actual Google Ads spend for this date
+            enhanced_data.append(placeholder_record(day, gads_data, metrics, windows))
+
+    return enhanced_data
+
+def ga4_fallback(app_config, gads_data, error, today=None):
+    """Rows to write when GA4 failed for an app."""
+    print(f"Error in fetch_ga4_data: {error}")
+
+    if is_retryable(error):
+        # Quota/transient failure that outlasted the scheduler's retries:
+        # write nothing rather than zero revenue. Runs through cleaning
+        # re-clean the last REFILL_DAYS days, so a later run writes the day
+        # as long as it comes within that many days
+        print(f"GA4 still unavailable after retries, skipping {app_config.get('app_name', 'Unnamed')} this run.")
         return []
 
-
-def calculate_averages(all_data, current_index, metric):
-    def get_average(days):
-        if current_index < days - 1:
-            return None
-        values = [
-            all_data[j][metric] for j in range(current_index - days + 1, current_index + 1)
-            if all_data[j][metric] is not None
+    # ✅ Even when GA4 fails, return data with Google Ads spend if available
+    if gads_data:
+        print(f"GA4 failed but Google Ads data available, creating fallback data...")
+        today = today or datetime.today()
+        metrics = rolling_metrics(app_config)
+        windows = rolling_windows(app_config)
+        return [
+            placeholder_record(day, gads_data, metrics, windows)
+            for day in range((today - timedelta(days=2)).toordinal(), (today - timedelta(days=1)).toordinal() + 1)
         ]
-        return round(sum(values) / len(values), 2) if values else None
-    return get_average(3), get_average(7), get_average(14)
-
-def calculate_simple_indicator(all_data, current_index, metric):
-    if current_index < 1:
-        return "0%"
-    current_value = all_data[current_index][metric]
-    previous_value = all_data[current_index - 1][metric]
-    if current_value is None or previous_value is None or previous_value == 0:
-        return "N/A"
-    change_percent = ((current_value - previous_value) / previous_value) * 100
-    if change_percent == 0:
-        return "0%"
-    elif change_percent > 0:
-        return f"+{change_percent:.1f}%"
-    else:
-        return f"{change_percent:.1f}%"
-
-def print_monthly_report(data):
+
+    return []
+
+def fetch_ga4_data(app_config, gads_data=None):
+    today = datetime.today()
+    try:
+        return combine_app_data(app_config, fetch_ga4_sources(app_config, today), gads_data, today)
+    except Exception as e:
+        return ga4_fallback(app_config, gads_data, e, today)
+
+
+def build_daily_records(ga4_data_lookup, renewal_data, gads_data, start_day, end_day,
+                        metrics=DEFAULT_METRICS, windows=DEFAULT_WINDOWS):
+    """
+    Merge GA4 revenue, renewals and Ads spend (all keyed by YYYY-MM-DD) into
+    DailyMetrics records, oldest first, with rolling metrics applied. If no
+    source has any day, every day in [start_day, end_day] gets a zero row.
+    """
+    # GA4 and Ads days drive the join; renewals only fill in those days
+    all_data = join_daily_records(
+        [ga4_revenue_source(ga4_data_lookup), gads_source(gads_data), renewal_source(renewal_data)],
+        start_day, end_day
+    )
+    apply_rolling_metrics(all_data, metrics, windows)
+    return all_data
+
+
+def display_days(today, recent_days=0):
+    """
+    First and last day ordinal shown for a run on `today`. The window is
+    [today - 2 days, today - 1 day] compared against midnight timestamps, so
+    the first day only counts when the run starts exactly at midnight. With
+    recent_days it reaches back to today - recent_days, so recent days are
+    cleaned again: to be restated in place, or written if a failed run
+    skipped them.
+    """
+    display_start_date = today - timedelta(days=2)
+    display_end_date = today - timedelta(days=1)
+    start_day = display_start_date.toordinal()
+    if display_start_date.time() > time.min:
+        start_day += 1
+    if recent_days:
+        start_day = min(start_day, today.toordinal() - recent_days)
+    return start_day, display_end_date.toordinal()
+
+
+def placeholder_record(day, gads_data, metrics, windows):
+    """Row for a day without GA4 data: Ads spend only, zero ROAS/ROI."""
+    gads_spend = to_micros(gads_data.get(date.fromordinal(day).isoformat(), 0.0))
+    record = DailyMetrics(day, gads_spend=gads_spend, total_spend=gads_spend)
+    record.roas = 0
+    record.roi = 0
+    record.extras.update(placeholder_rolling_values(metrics, windows))
+    return record
+
+
+def print_monthly_report(data, app_config=None):
     monthly_data = defaultdict(list)
-    for row in sorted(data, key=lambda x: datetime.strptime(x["Formatted_Date"], "%d-%m-%Y")):
+    for row in sorted(data, key=lambda x: x.day):
         monthly_data[row["Month"]].append(row)
 
+    rolling_cols = indicator_columns(app_config)
     for month, rows in monthly_data.items():
-        print(f"{month}\tGads_Spend\tTotal_spend\tTotal New Revenue\tAd Revenue\tIAP_Revenue\tCount of Purchases\tRenewal\tRenewal_Count\tTotal Revenue\tROAS\tROI\tL3_ROAS\tL7_ROAS\tL14_ROAS\tL3_ROI\tL7_ROI\tL14_ROI\tROAS_Indicator\tROI_Indicator")
+        print(f"{month}\tGads_Spend\tTotal_spend\tTotal New Revenue\tAd Revenue\tIAP_Revenue\tCount of Purchases\tRenewal\tRenewal_Count\tTotal Revenue\t" + "\t".join(rolling_cols))
         for row in rows:
             def money(val): return f"${val:.2f}" if isinstance(val, (float, int)) else "N/A"
             def format_val(val): return f"{val:.2f}" if isinstance(val, (float, int)) else "N/A"
-            print(f"{row['Formatted_Date']}\t{money(row['Gads_Spend'])}\t{money(row['Total_spend'])}\t{money(row['Total New Revenue'])}\t{money(row['Ad Revenue'])}\t{money(row['IAP_Revenue'])}\t{row['Count of Purchases']}\t{row['Renewal']}\t{row['Renewal_Count']}\t{money(row['Total New Revenue'])}\t{format_val(row['ROAS'])}\t{format_val(row['ROI'])}\t{format_val(row['L3_ROAS'])}\t{format_val(row['L7_ROAS'])}\t{format_val(row['L14_ROAS'])}\t{format_val(row['L3_ROI'])}\t{format_val(row['L7_ROI'])}\t{format_val(row['L14_ROI'])}\t{row['ROAS_Indicator']}\t{row['ROI_Indicator']}")
+            rolling_vals = [row[col] if col.endswith("_Indicator") else format_val(row[col]) for col in rolling_cols]
+            print(f"{row['Formatted_Date']}\t{money(row['Gads_Spend'])}\t{money(row['Total_spend'])}\t{money(row['Total New Revenue'])}\t{money(row['Ad Revenue'])}\t{money(row['IAP_Revenue'])}\t{row['Count of Purchases']}\t{row['Renewal']}\t{row['Renewal_Count']}\t{money(row['Total New Revenue'])}\t" + "\t".join(str(v) for v in rolling_vals))
 
 def debug_private_key(ga4_config):
     try:
@@ -388,11 +268,19 @@ if __name__ == "__main__":
         for idx, app_config in enumerate(configs):
             print(f"\n--- App {idx+1}: {app_config.get('app_name', 'Unnamed')} ---")
             try:
-                gads_data = fetch_gads_data(app_config)
-                print(f"Google Ads data fetched: {len(gads_data) if gads_data else 0} days")
-                ga4_data = fetch_ga4_data(app_config, gads_data)
+                # Ads and GA4 are fetched side by side, then combined
+                today = datetime.today()
+                with ThreadPoolExecutor(max_workers=2) as pool:
+                    gads_future = pool.submit(fetch_gads_data, app_config)
+                    ga4_future = pool.submit(fetch_ga4_sources, app_config, today)
+                    gads_data = gads_future.result()
+                    print(f"Google Ads data fetched: {len(gads_data) if gads_data else 0} days")
+                    try:
+                        ga4_data = combine_app_data(app_config, ga4_future.result(), gads_data, today)
+                    except Exception as e:
+                        ga4_data = ga4_fallback(app_config, gads_data, e, today)
                 print(f"Final data rows: {len(ga4_data) if ga4_data else 0}")
-                print_monthly_report(ga4_data)
+                print_monthly_report(ga4_data, app_config)
             except Exception as e:
                 print(f"Error processing app {idx+1}: {e}")
     except Exception as e:
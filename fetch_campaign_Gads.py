@@ -1,41 +1,88 @@
-from google.ads.googleads.client import GoogleAdsClient
-from google.ads.googleads.errors import GoogleAdsException
+import sys
 from datetime import datetime, timedelta
-from make_client import make_client
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from campaign_ids import gads_spend_queries
+from client_pool import get_gads_service
+from concurrency import get_limit
+from response_cache import cached_response, normalize_query
+from scheduler import call_api, is_retryable
+from telemetry import app_context, count, payload_bytes, stage
+from metrics_store import fetch_with_history, get_store
 import json
 
-def fetch_gads_data(app_config):
-    client = make_client(app_config["gads"])
-    ga_service = client.get_service("GoogleAdsService")
-
-    today = datetime.today()
-    day_2 = (today - timedelta(days=2)).strftime('%Y-%m-%d')
+def gads_date_window(app_config, today=None, min_days=0):
+    today = today or datetime.today()
+    # At least min_days back, e.g. the days a run restates in the sheets
+    date_range_days = max(app_config.get('date_range_days', 2), min_days)
+    day_start = (today - timedelta(days=date_range_days)).strftime('%Y-%m-%d')
     day_1 = (today - timedelta(days=1)).strftime('%Y-%m-%d')
+    return day_start, day_1
+
+def normalize_gads_date(raw_date):
+    raw_date = str(raw_date)
+    if len(raw_date) == 8 and raw_date.isdigit():
+        return f"{raw_date[:4]}-{raw_date[4:6]}-{raw_date[6:]}"
+    return datetime.strptime(raw_date, "%Y-%m-%d").strftime("%Y-%m-%d")
+
+def stream_spend_micros(ga_service, customer_id, query, key, rows_stage=None):
+    """Sum cost_micros per key(row) while search_stream batches arrive, as one scheduled Ads call."""
+    def _stream():
+        # Folded inside the scheduled call so a retry starts from zero
+        spend_micros = defaultdict(int)
+        for batch in ga_service.search_stream(customer_id=customer_id, query=query):
+            count("bytes_received", payload_bytes(batch), api="gads")
+            if rows_stage:
+                count("rows", len(batch.results), stage=rows_stage)
+            for row in batch.results:
+                spend_micros[key(row)] += row.metrics.cost_micros
+        return spend_micros
+
+    return call_api("gads", _stream, scope=customer_id)
+
+def _row_date(row):
+    return normalize_gads_date(row.segments.date)
+
+def stream_daily_spend(ga_service, customer_id, queries):
+    """Sum cost_micros per day over one or more queries while search_stream batches arrive."""
+    if isinstance(queries, str):
+        queries = [queries]
+
+    spend_micros = defaultdict(int)
+    with stage("gads_query"):
+        for query in queries:
+            daily_micros = cached_response(
+                "gads", [customer_id, normalize_query(query)],
+                lambda: stream_spend_micros(ga_service, customer_id, query, _row_date, "gads_query"))
+            for date_str, micros in daily_micros.items():
+                spend_micros[date_str] += micros
+    return {date_str: micros / 1_000_000 for date_str, micros in spend_micros.items()}
+
+def is_gads_exception(ex):
+    # The Ads SDK is only imported once a client is built; if it isn't
+    # loaded, nothing can have raised a GoogleAdsException
+    errors = sys.modules.get("google.ads.googleads.errors")
+    exception_type = getattr(errors, "GoogleAdsException", None)
+    return exception_type is not None and isinstance(ex, exception_type)
+
+def print_gads_exception(app_name, ex):
+    print(f"GoogleAdsException for {app_name}: {ex}")
+    for error in ex.failure.errors:
+        print(f"Error: {error.message}")
+        if error.location:
+            for field_path_element in error.location.field_path_elements:
+                print(f"On field: {field_path_element.field_name}")
+
+def print_daily_spend(app_name, daily_spend):
+    for date in sorted(daily_spend.keys()):
+        print(f"{app_name} | {date}: ${daily_spend[date]:.2f}")
+
+def fetch_gads_data(app_config):
+    ga_service = get_gads_service(app_config["gads"])
 
     campaign_prefix = app_config.get("campaign_prefix", "")
     app_name = app_config.get('app_name', 'Unnamed')
-    date_range_days = app_config.get('date_range_days', 2)
-    day_start = (today - timedelta(days=date_range_days)).strftime('%Y-%m-%d')
-
-    if campaign_prefix:
-        query = f"""
-            SELECT
-                campaign.name,
-                segments.date,
-                metrics.cost_micros
-            FROM campaign
-            WHERE campaign.name LIKE '{campaign_prefix}%'
-            AND segments.date BETWEEN '{day_start}' AND '{day_1}'
-        """
-    else:
-        query = f"""
-            SELECT
-                campaign.name,
-                segments.date,
-                metrics.cost_micros
-            FROM campaign
-            WHERE segments.date BETWEEN '{day_start}' AND '{day_1}'
-        """
+    day_start, day_1 = gads_date_window(app_config)
 
     customer_id = app_config["gads"].get("customer_id")
     if not customer_id:
@@ -43,37 +90,108 @@ def fetch_gads_data(app_config):
         return {}
 
     try:
-        response = ga_service.search(customer_id=customer_id, query=query)
-        daily_spend = {}
-        campaigns_found = set()
-
-        for row in response:
-            campaigns_found.add(row.campaign.name)
-            # Process spend for all apps now
-            raw_date = row.segments.date
-            try:
-                date_obj = datetime.strptime(str(raw_date), "%Y%m%d")
-            except ValueError:
-                date_obj = datetime.strptime(str(raw_date), "%Y-%m-%d")
-            date_str = date_obj.strftime("%Y-%m-%d")
-            spend = row.metrics.cost_micros / 1_000_000
-            daily_spend[date_str] = daily_spend.get(date_str, 0) + spend
+        (daily_spend,) = fetch_with_history(
+            app_name, ("gads",), day_start, day_1,
+            lambda fetch_start, fetch_end: (
+                stream_daily_spend(
+                    ga_service, customer_id,
+                    gads_spend_queries(ga_service, customer_id, campaign_prefix, fetch_start, fetch_end)
+                ),
+            )
+        )
 
         # Print all spend days in sorted order
-        for date in sorted(daily_spend.keys()):
-            print(f"{app_name} | {date}: ${daily_spend[date]:.2f}")
+        print_daily_spend(app_name, daily_spend)
 
         return daily_spend
 
-    except GoogleAdsException as ex:
-        print(f"GoogleAdsException for {app_config.get('app_name', 'Unknown')}: {ex}")
-        for error in ex.failure.errors:
-            print(f"Error: {error.message}")
-            if error.location:
-                for field_path_element in error.location.field_path_elements:
-                    print(f"On field: {field_path_element.field_name}")
+    except Exception as ex:
+        if not is_gads_exception(ex):
+            raise
+        print_gads_exception(app_config.get('app_name', 'Unknown'), ex)
         return {}
 
+def fetch_gads_range(app_config, start_date_str, end_date_str):
+    """Daily spend for an explicit date range; errors are raised, not swallowed."""
+    customer_id = app_config["gads"].get("customer_id")
+    if not customer_id:
+        raise ValueError(f"CUSTOMER_ID not found for {app_config.get('app_name', 'Unknown')}")
+    ga_service = get_gads_service(app_config["gads"])
+    queries = gads_spend_queries(ga_service, customer_id, app_config.get("campaign_prefix", ""),
+                                 start_date_str, end_date_str)
+    return stream_daily_spend(ga_service, customer_id, queries)
+
+def fetch_gads_data_for_apps(configs, max_workers=None, today=None, recent_days=0):
+    """
+    Fetch Ads spend for many apps at once.
+
+    Apps are grouped by MCC so each group shares one client/channel, then
+    one set of spend queries per distinct (customer, prefix, window) runs
+    concurrently. Date windows end the day before `today` (default: now)
+    and cover at least the last `recent_days` days.
+    Returns a list of daily spend dicts aligned with `configs`. Failures stay
+    with the apps of the failing task: those apps get None instead, so they
+    aren't written with $0 spend, and every other app is fetched as usual.
+    """
+    configs = list(configs)
+    results = [{} for _ in configs]
+    store = get_store()
+
+    # (mcc_id, customer_id, prefix, start, end) -> indexes of apps that need it
+    tasks = defaultdict(list)
+    windows = {}
+    for idx, app_config in enumerate(configs):
+        gads_config = app_config.get("gads") or {}
+        customer_id = gads_config.get("customer_id")
+        if not customer_id:
+            print(f" CUSTOMER_ID not found for {app_config.get('app_name', 'Unknown') }.")
+            continue
+        mcc_id = str(gads_config.get("mcc_id") or "")
+        day_start, day_1 = gads_date_window(app_config, today, recent_days)
+        # Settled days are read back from the store, only the tail is queried
+        fetch_start = store.fetch_start(app_config.get('app_name', 'Unnamed'), "gads", day_start) if store else day_start
+        windows[idx] = (day_start, fetch_start, day_1)
+        tasks[(mcc_id, str(customer_id), app_config.get("campaign_prefix", ""), fetch_start, day_1)].append(idx)
+
+    def _run(task):
+        mcc_id, customer_id, campaign_prefix, fetch_start, fetch_end = task
+        app_indexes = tasks[task]
+        try:
+            # The pool hands every app under the same MCC and credentials one service
+            with app_context(configs[app_indexes[0]].get('app_name', 'Unnamed')):
+                ga_service = get_gads_service(configs[app_indexes[0]]["gads"])
+                queries = gads_spend_queries(ga_service, customer_id, campaign_prefix, fetch_start, fetch_end)
+                return stream_daily_spend(ga_service, customer_id, queries), True
+        except Exception as e:
+            if is_gads_exception(e):
+                print_gads_exception(configs[app_indexes[0]].get('app_name', 'Unknown'), e)
+            elif is_retryable(e):
+                print(f"Google Ads still unavailable after retries for customer {customer_id}: {e}")
+            else:
+                # e.g. revoked credentials for this MCC; the other tasks carry on
+                print(f"Error fetching Google Ads data for customer {customer_id}: {e}")
+        return {}, False
+
+    if tasks:
+        workers = max_workers or get_limit("gads")
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tasks)))) as pool:
+            for task, (daily_spend, ok) in zip(tasks, pool.map(_run, list(tasks))):
+                for idx in tasks[task]:
+                    if not ok:
+                        results[idx] = None
+                        continue
+                    app_name = configs[idx].get('app_name', 'Unnamed')
+                    day_start, fetch_start, day_1 = windows[idx]
+                    merged = {}
+                    if store:
+                        merged = store.history(app_name, "gads", day_start, fetch_start)
+                        store.save(app_name, "gads", daily_spend, fetch_start, day_1, today)
+                    merged.update(daily_spend)
+                    results[idx] = merged
+                    print_daily_spend(app_name, merged)
+
+    return results
+
 if __name__ == "__main__":
     with open("apps_config.json") as f:
         configs = json.load(f)
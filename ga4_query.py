@@ -0,0 +1,185 @@
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+from response_cache import cached_response
+from scheduler import call_api, observe_ga4_quota
+from telemetry import count, payload_bytes, stage
+
+# Both GA4 reports an app needs (revenue + purchase-event renewals) go out
+# as one batch_run_reports round trip, and apps that point at the same
+# property share a single query per run.
+
+REVENUE_METRICS = ["totalRevenue", "purchaseRevenue", "transactions"]
+RENEWAL_METRICS = ["eventCount", "totalUsers"]
+
+# Rows per RunReport page; the Data API caps a single page at 250,000
+PAGE_SIZE = 100_000
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+_stats = {"requests": 0, "deduplicated": 0}
+
+
+def build_revenue_request(property_id, start_date_str, end_date_str, offset=0, limit=PAGE_SIZE):
+    # The Data API types are imported on first use to keep startup light
+    from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, RunReportRequest
+
+    return RunReportRequest(
+        property=f"properties/{property_id}",
+        dimensions=[Dimension(name="date")],
+        metrics=[Metric(name=name) for name in REVENUE_METRICS],
+        date_ranges=[DateRange(start_date=start_date_str, end_date=end_date_str)],
+        offset=offset,
+        limit=limit,
+        return_property_quota=True
+    )
+
+
+def build_renewal_request(property_id, start_date_str, end_date_str, offset=0, limit=PAGE_SIZE):
+    from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, RunReportRequest
+
+    return RunReportRequest(
+        property=f"properties/{property_id}",
+        dimensions=[Dimension(name="date")],
+        metrics=[Metric(name=name) for name in RENEWAL_METRICS],
+        date_ranges=[DateRange(start_date=start_date_str, end_date=end_date_str)],
+        offset=offset,
+        limit=limit,
+        return_property_quota=True,
+        dimension_filter={
+            'filter': {
+                'field_name': 'eventName',
+                'string_filter': {'value': 'purchase'}
+            }
+        }
+    )
+
+
+def parse_revenue_rows(rows):
+    ga4_data_lookup = {}
+    for row in rows:
+        raw_date = row.dimension_values[0].value
+        date_str = datetime.strptime(raw_date, "%Y%m%d").strftime("%Y-%m-%d")
+        ga4_data_lookup[date_str] = {
+            "total_revenue": float(row.metric_values[0].value or 0.0),
+            "iap_revenue": float(row.metric_values[1].value or 0.0),
+            "count_of_purchases": int(row.metric_values[2].value or 0)
+        }
+    return ga4_data_lookup
+
+
+def parse_renewal_rows(rows):
+    renewal_data = {}
+    for row in rows:
+        raw_date = row.dimension_values[0].value
+        date_str = datetime.strptime(raw_date, "%Y%m%d").strftime("%Y-%m-%d")
+        renewal_data[date_str] = {
+            "Renewal": int(row.metric_values[1].value or 0),
+            "Renewal_Count": int(row.metric_values[0].value or 0)
+        }
+    return renewal_data
+
+
+def run_report(client, property_id, request):
+    """One scheduled RunReport call; feeds the returned quota back to the scheduler."""
+    with stage("ga4_report"):
+        report = call_api("ga4", client.run_report, request, scope=property_id)
+    count("bytes_received", payload_bytes(report), api="ga4")
+    count("rows", len(report.rows), stage="ga4_report")
+    observe_ga4_quota(property_id, getattr(report, "property_quota", None))
+    return report
+
+
+def iter_report_rows(client, first_report, build_page, property_id=None):
+    """
+    Rows of `first_report` followed by the rows of any further pages.
+    build_page(offset) must return the RunReportRequest for that offset.
+    """
+    yield from first_report.rows
+    fetched = len(first_report.rows)
+    while fetched and fetched < (first_report.row_count or 0):
+        page = run_report(client, property_id, build_page(fetched))
+        if not page.rows:
+            break
+        yield from page.rows
+        fetched += len(page.rows)
+
+
+def _run_batch(client, property_id, start_date_str, end_date_str):
+    from google.analytics.data_v1beta.types import BatchRunReportsRequest
+
+    request = BatchRunReportsRequest(
+        property=f"properties/{property_id}",
+        requests=[
+            build_revenue_request(property_id, start_date_str, end_date_str),
+            build_renewal_request(property_id, start_date_str, end_date_str)
+        ]
+    )
+    with stage("ga4_report"):
+        response = call_api("ga4", client.batch_run_reports, request, scope=property_id)
+    count("bytes_received", payload_bytes(response), api="ga4")
+    revenue_report, renewal_report = response.reports
+    count("rows", len(revenue_report.rows) + len(renewal_report.rows), stage="ga4_report")
+    observe_ga4_quota(property_id, getattr(renewal_report, "property_quota", None))
+    revenue_rows = iter_report_rows(
+        client, revenue_report,
+        lambda offset: build_revenue_request(property_id, start_date_str, end_date_str, offset),
+        property_id
+    )
+    renewal_rows = iter_report_rows(
+        client, renewal_report,
+        lambda offset: build_renewal_request(property_id, start_date_str, end_date_str, offset),
+        property_id
+    )
+    return parse_revenue_rows(revenue_rows), parse_renewal_rows(renewal_rows)
+
+
+def fetch_property_metrics(client, property_id, start_date_str, end_date_str):
+    """
+    Return (ga4_data_lookup, renewal_data) for one property and date range,
+    both keyed by YYYY-MM-DD. Concurrent callers asking for the same
+    property and range wait on one shared request.
+    """
+    key = (str(property_id), start_date_str, end_date_str)
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[key] = future
+            _stats["requests"] += 1
+        else:
+            _stats["deduplicated"] += 1
+
+    if owner:
+        try:
+            # Other entry points run shortly before/after share the on-disk copy
+            future.set_result(tuple(cached_response(
+                "ga4", [property_id, start_date_str, end_date_str, "revenue+renewal"],
+                lambda: _run_batch(client, property_id, start_date_str, end_date_str)
+            )))
+        except Exception as e:
+            # Don't cache failures; the next app retries the property
+            with _inflight_lock:
+                _inflight.pop(key, None)
+            future.set_exception(e)
+
+    ga4_data_lookup, renewal_data = future.result()
+    # Callers get their own copies so one app can't mutate another's rows
+    return (
+        {d: dict(v) for d, v in ga4_data_lookup.items()},
+        {d: dict(v) for d, v in renewal_data.items()}
+    )
+
+
+def reset_property_cache():
+    """Forget per-run results; call at the start of every pipeline run."""
+    with _inflight_lock:
+        _inflight.clear()
+        _stats["requests"] = 0
+        _stats["deduplicated"] = 0
+
+
+def query_stats():
+    with _inflight_lock:
+        return dict(_stats)
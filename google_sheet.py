@@ -1,10 +1,17 @@
 from cleaning import clean_ga4_data_all_apps, print_cleaned_data_grouped_all_apps
-import gspread
-from google.oauth2.service_account import Credentials
 from datetime import datetime
+import argparse
 import json
 import re
 import traceback
+from client_pool import get_sheets_client, SHEETS_SCOPES
+from rolling import indicator_columns
+from run_journal import WAREHOUSE, mark_done, pending_apps, start_run
+from records import month_sort_key, sheet_months
+from sheet_writer import DAILY_COLUMNS, append_block, number_formats, print_write_totals, reset_write_totals
+from sheet_index import read_column_a, record_append
+from scheduler import call_api
+from telemetry import app_context, export_metrics
 
 def normalize_date(date_str):
     
@@ -15,19 +22,26 @@ def normalize_date(date_str):
             continue
     return date_str  
 
-def append_all_apps_to_sheets(config_file="apps_config.json"):
-    # Load all app configs
+def append_all_apps_to_sheets(config_file="apps_config.json", all_apps_monthly_data=None, app_names=None):
+    # Returns the apps whose warehouse tab is now up to date
+    # Load all app configs (or only `app_names`)
     with open(config_file) as f:
         configs = json.load(f)
+    if app_names:
+        configs = [c for c in configs if c.get("app_name", "Unnamed") in set(app_names)]
+    # A resumed run only cleans and writes the apps it hadn't written yet
+    names = [c.get("app_name", "Unnamed") for c in configs]
+    pending = set(pending_apps(names, WAREHOUSE))
+    configs = [c for c in configs if c.get("app_name", "Unnamed") in pending]
+    # Apps this run already wrote are up to date too
+    written = [app for app in names if app not in pending]
+    if not configs:
+        return written
 
     # Clean and group data for all apps
-    all_apps_monthly_data = clean_ga4_data_all_apps(config_file)
-
-    # Setup credentials scope
-    scope = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive"
-    ]
+    if all_apps_monthly_data is None:
+        all_apps_monthly_data = clean_ga4_data_all_apps(config_file, app_names=sorted(pending))
+    reset_write_totals()
 
     for app_config in configs:
         app_name = app_config.get("app_name", "Unnamed")
@@ -41,8 +55,7 @@ def append_all_apps_to_sheets(config_file="apps_config.json"):
         if not service_account_info or not service_account_info.get("private_key"):
             print(f"Missing or invalid service account info for app '{app_name}'. Skipping.")
             continue
-        creds = Credentials.from_service_account_info(service_account_info, scopes=scope)
-        client = gspread.authorize(creds)
+        client = get_sheets_client(service_account_info, SHEETS_SCOPES)
 
         # Get sheet info from sheets
         sheets_info = app_config.get("sheets", {})
@@ -57,72 +70,69 @@ def append_all_apps_to_sheets(config_file="apps_config.json"):
             print(f"Missing sheet_id or sheet_name for app '{app_name}'. Skipping.")
             continue
         try:
-            worksheet = client.open_by_key(SHEET_ID).worksheet(SHEET_NAME)
+            worksheet = call_api("sheets", lambda: client.open_by_key(SHEET_ID).worksheet(SHEET_NAME), scope=SHEET_ID)
         except Exception as e:
             print(f"Error opening sheet for app '{app_name}': {e}")
             traceback.print_exc()
             continue
 
-        col_a = worksheet.col_values(1)
+        with app_context(app_name):
+            col_a = read_column_a(worksheet, SHEET_ID, SHEET_NAME)
         existing_dates = set(
             normalize_date(str(cell).strip())
             for cell in col_a if "-" in str(cell)
         )
-        existing_months = set(str(cell).strip() for cell in col_a if "-" not in str(cell) and str(cell).strip())
-        last_row = len(col_a) + 1
+        # Matched on (year, month): backfilled "October 2024" and daily "October" are the same block
+        existing_months = sheet_months(col_a)
+        rolling_cols = indicator_columns(app_config)
+        columns = list(DAILY_COLUMNS) + rolling_cols
 
-        for month in sorted(monthly_data, key=lambda m: datetime.strptime(m, "%B").month):
+        # Build the whole block for this worksheet, then write it in one go
+        block = []
+        for month in sorted(monthly_data, key=month_sort_key):
             month_rows = monthly_data[month]
             new_rows = [
                 row for row in sorted(
                     month_rows,
-                    key=lambda r: datetime.strptime(r["Formatted_Date"], "%d-%m-%Y")
+                    key=lambda r: r.day
                 )
-                if normalize_date(row["Formatted_Date"]) not in existing_dates
+                if row.date_str not in existing_dates
             ]
             if not new_rows:
                 continue
-            if month not in existing_months:
-                worksheet.append_row([
+            month_key = (new_rows[0].date.year, new_rows[0].date.month)
+            if month_key not in existing_months:
+                block.append([
                     month,
                     "Gads_Spend", "Total_spend", "Total New Revenue",
                     "Ad Revenue", "IAP_Revenue", "Count of Purchases",
-                    "Renewal", "Renewal_Count", "Total Revenue",
-                    "ROAS", "ROI", "L3_ROAS", "L7_ROAS", "L14_ROAS",
-                    "L3_ROI", "L7_ROI", "L14_ROI",
-                    "ROAS_Indicator", "ROI_Indicator"
-                ])
-                last_row += 1
+                    "Renewal", "Renewal_Count", "Total Revenue"
+                ] + rolling_cols)
             for row in new_rows:
-                row_data = [
-                    row["Formatted_Date"],
-                    row["Gads_Spend"],
-                    row["Total_spend"],
-                    row["Total New Revenue"],
-                    row["Ad Revenue"],
-                    row["IAP_Revenue"],
-                    row["Count of Purchases"],
-                    row["Renewal"],
-                    row["Renewal_Count"],
-                    row["Total Revenue"],
-                    row["ROAS"],
-                    row["ROI"],
-                    row["L3_ROAS"],
-                    row["L7_ROAS"],
-                    row["L14_ROAS"],
-                    row["L3_ROI"],
-                    row["L7_ROI"],
-                    row["L14_ROI"],
-                    row["ROAS_Indicator"],
-                    row["ROI_Indicator"]
-                ]
-                worksheet.append_row(row_data)
-                last_row += 1
-            for _ in range(3):
-                worksheet.append_row([""] * 21)
-                last_row += 1
-            existing_months.add(month)
+                # Raw numbers; the block's number formats display them
+                block.append([row.typed(col) for col in columns])
+            block.extend([""] * (len(rolling_cols) + 11) for _ in range(3))
+            existing_months.add(month_key)
+
+        if block:
+            with app_context(app_name):
+                stats = append_block(worksheet, block, formats=number_formats(columns))
+            record_append(SHEET_ID, SHEET_NAME, col_a, block, stats["responses"])
+            print(f"Wrote {stats['rows']} row(s) / {stats['cells']} cell(s) in {stats['api_calls']} call(s), "
+                  f"saved {stats['calls_saved']} call(s)")
         print(f"New data appended to '{SHEET_NAME}' tab for app '{app_name}' successfully.")
+        mark_done(app_name, WAREHOUSE)
+        written.append(app_name)
+    print_write_totals()
+    return written
 
 if __name__ == "__main__":
-    append_all_apps_to_sheets()
+    parser = argparse.ArgumentParser(description="Append new daily rows to each app's warehouse tab.")
+    parser.add_argument("--config", default="apps_config.json")
+    parser.add_argument("--run-id", help="Journal name for this run (default: today's date)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the run: skip apps already written, reuse data already fetched")
+    args = parser.parse_args()
+    start_run(args.run_id, args.resume)
+    append_all_apps_to_sheets(args.config)
+    export_metrics()
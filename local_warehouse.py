@@ -0,0 +1,274 @@
+import argparse
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import date
+from records import DailyMetrics
+from run_journal import LOCAL_WAREHOUSE, mark_done, pending_apps
+from telemetry import count, export_metrics, stage
+
+# Local columnar copy of the cleaned daily rows, next to the Sheets output.
+# One file per app and month, hive-style so other tools can find them:
+#
+#   warehouse/app=Job-Search/month=2026-10.cols
+#
+# A file is a small JSON header followed by one contiguous int64 array per
+# column (day ordinal, money in micros, counts). Readers mmap the file and
+# get zero-copy memoryviews of the columns, so scanning years of data never
+# parses anything or touches the Sheets API. Writes rebuild the month in a
+# temp file and os.replace() it, so a reader sees the old or the new month,
+# never half of one; a day written again replaces the stored one.
+
+DEFAULT_WAREHOUSE_DIR = "warehouse"
+MAGIC = b"AUTCOL01"
+COLUMNS = (
+    "day", "gads_spend", "total_spend", "total_revenue", "iap_revenue",
+    "purchases", "renewal", "renewal_count"
+)
+_HEADER_LENGTH = struct.Struct("<I")
+_PREFIX_SIZE = len(MAGIC) + _HEADER_LENGTH.size
+_ITEM_SIZE = array("q").itemsize
+
+_lock = threading.Lock()
+_root = DEFAULT_WAREHOUSE_DIR
+
+
+def configure_local_warehouse(path=DEFAULT_WAREHOUSE_DIR):
+    global _root
+    with _lock:
+        _root = path
+
+
+def _slug(app_name):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", app_name) or "_"
+
+
+def partition_path(app_name, year, month, root=None):
+    return os.path.join(root or _root, f"app={_slug(app_name)}", f"month={year:04d}-{month:02d}.cols")
+
+
+class Partition:
+    """
+    One app-month file, memory-mapped. `columns` maps column name -> int64
+    memoryview over the file; use as a context manager (or call close())
+    so the mapping is released.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a warehouse partition")
+        (header_length,) = _HEADER_LENGTH.unpack_from(self._mmap, len(MAGIC))
+        offset = _PREFIX_SIZE
+        self.header = json.loads(self._mmap[offset:offset + header_length])
+        if self.header["byteorder"] != sys.byteorder:
+            self._mmap.close()
+            raise ValueError(f"{path} was written on a {self.header['byteorder']}-endian machine")
+        offset += header_length
+
+        self.rows = self.header["rows"]
+        self._view = memoryview(self._mmap)
+        self.columns = {}
+        for name in self.header["columns"]:
+            size = self.rows * _ITEM_SIZE
+            self.columns[name] = self._view[offset:offset + size].cast("q")
+            offset += size
+
+    @property
+    def app(self):
+        return self.header["app"]
+
+    def __len__(self):
+        return self.rows
+
+    def records(self):
+        """The month's rows as DailyMetrics, oldest first."""
+        columns = [self.columns[name] for name in COLUMNS]
+        return [DailyMetrics(*values) for values in zip(*columns)]
+
+    def close(self):
+        for view in self.columns.values():
+            view.release()
+        self.columns = {}
+        self._view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def open_partition(path):
+    return Partition(path)
+
+
+def _encode(app_name, rows):
+    header = {"app": app_name, "rows": len(rows), "columns": list(COLUMNS), "byteorder": sys.byteorder}
+    text = json.dumps(header).encode()
+    # Pad the header with spaces so the int64 columns start 8-byte aligned
+    text += b" " * (-(_PREFIX_SIZE + len(text)) % 8)
+
+    chunks = [MAGIC, _HEADER_LENGTH.pack(len(text)), text]
+    for index in range(len(COLUMNS)):
+        chunks.append(array("q", (row[index] for row in rows)).tobytes())
+    return b"".join(chunks)
+
+
+def _record_values(record):
+    return tuple(getattr(record, name) for name in COLUMNS)
+
+
+def _write_partition(path, app_name, records):
+    """Merge `records` into the month file at `path`; returns the number of rows it holds."""
+    rows = {}
+    if os.path.exists(path):
+        with Partition(path) as existing:
+            columns = [existing.columns[name] for name in COLUMNS]
+            rows = {values[0]: values for values in zip(*columns)}
+    for record in records:
+        rows[record.day] = _record_values(record)
+    rows = [rows[day] for day in sorted(rows)]
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".month.", suffix=".tmp")
+    try:
+        # mkstemp files are owner-only; partitions are meant to be shared with readers
+        os.chmod(tmp_path, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            f.write(_encode(app_name, rows))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(rows)
+
+
+def append_records(app_name, records, root=None):
+    """Write an app's DailyMetrics into its month partitions; returns how many were written."""
+    by_month = defaultdict(list)
+    for record in records:
+        d = record.date
+        by_month[(d.year, d.month)].append(record)
+
+    written = 0
+    with _lock:
+        for (year, month), month_records in sorted(by_month.items()):
+            _write_partition(partition_path(app_name, year, month, root), app_name, month_records)
+            written += len(month_records)
+    return written
+
+
+def write_all_apps_to_local(all_apps_monthly_data, root=None):
+    """Sink for clean_ga4_data_all_apps() output: {app: {month label: [DailyMetrics]}}."""
+    for app_name in pending_apps(list(all_apps_monthly_data), LOCAL_WAREHOUSE):
+        monthly_data = all_apps_monthly_data[app_name]
+        records = [record for month_rows in monthly_data.values() for record in month_rows]
+        if not records:
+            continue
+        with stage("local_warehouse", app=app_name):
+            written = append_records(app_name, records, root)
+        count("rows", written, stage="local_warehouse", app=app_name)
+        mark_done(app_name, LOCAL_WAREHOUSE)
+    print(f"Local warehouse updated in '{root or _root}' for {len(all_apps_monthly_data)} app(s).")
+
+
+def _month_key(day):
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+def partitions(app_name=None, start=None, end=None, root=None):
+    """Paths of the partitions for one app (or all apps) overlapping [start, end]."""
+    root = root or _root
+    if not os.path.isdir(root):
+        return []
+    if app_name is not None:
+        app_dirs = [f"app={_slug(app_name)}"]
+    else:
+        app_dirs = sorted(name for name in os.listdir(root) if name.startswith("app="))
+    first = _month_key(start) if start else None
+    last = _month_key(end) if end else None
+
+    paths = []
+    for app_dir in app_dirs:
+        directory = os.path.join(root, app_dir)
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if not (name.startswith("month=") and name.endswith(".cols")):
+                continue
+            month = name[len("month="):-len(".cols")]
+            if (first and month < first) or (last and month > last):
+                continue
+            paths.append(os.path.join(directory, name))
+    return paths
+
+
+def _ordinal(day):
+    if day is None:
+        return None
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return day.toordinal()
+
+
+def read_records(app_name, start=None, end=None, root=None):
+    """An app's stored DailyMetrics between `start` and `end` (dates or YYYY-MM-DD), oldest first."""
+    first, last = _ordinal(start), _ordinal(end)
+    records = []
+    for path in partitions(app_name, start, end, root):
+        with open_partition(path) as partition:
+            records.extend(
+                record for record in partition.records()
+                if (first is None or record.day >= first) and (last is None or record.day <= last)
+            )
+    return records
+
+
+def sum_columns(app_name=None, start=None, end=None, columns=COLUMNS[1:], root=None):
+    """
+    {app: {column: total}} over [start, end], summed straight from the
+    mapped columns without building a record per day.
+    """
+    first, last = _ordinal(start), _ordinal(end)
+    totals = {}
+    for path in partitions(app_name, start, end, root):
+        with open_partition(path) as partition:
+            days = partition.columns["day"]
+            # Days are stored sorted, so the range is two binary searches
+            lo = bisect_left(days, first) if first is not None else 0
+            hi = bisect_right(days, last) if last is not None else len(partition)
+            app_totals = totals.setdefault(partition.app, dict.fromkeys(columns, 0))
+            for name in columns:
+                app_totals[name] += sum(partition.columns[name][lo:hi])
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the cleaned daily rows to the local columnar warehouse.")
+    parser.add_argument("--config", default="apps_config.json")
+    parser.add_argument("--root", default=DEFAULT_WAREHOUSE_DIR)
+    args = parser.parse_args()
+
+    from cleaning import clean_ga4_data_all_apps
+    configure_local_warehouse(args.root)
+    write_all_apps_to_local(clean_ga4_data_all_apps(args.config))
+    export_metrics()
@@ -3,7 +3,17 @@ from google.ads.googleads.client import GoogleAdsClient
 from google.ads.googleads.errors import GoogleAdsException
 
 
-def make_client(gads_config, mcc_id=None) -> GoogleAdsClient:
+def make_client(gads_config, mcc_id=None, credentials=None) -> GoogleAdsClient:
+    if credentials is not None:
+        # Pre-built OAuth credentials, e.g. from client_pool's token cache
+        client = GoogleAdsClient(
+            credentials=credentials,
+            developer_token=gads_config["developer_token"],
+            use_proto_plus=True
+        )
+        client.login_customer_id = mcc_id or gads_config.get("mcc_id")
+        return client
+
     credentials = {
         "developer_token": gads_config["developer_token"],
         "refresh_token": gads_config["refresh_token"],
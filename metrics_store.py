@@ -0,0 +1,204 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+# Local store of daily metrics per app and source, plus a watermark per
+# (app, source): every day up to the watermark is settled and read from disk,
+# so a run only re-fetches the unsettled tail from the APIs.
+
+DEFAULT_STORE_PATH = "metrics_store.db"
+
+# GA4 and Ads numbers keep moving for a few days; only older days are final
+UNSETTLED_DAYS = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_metrics (
+    app TEXT NOT NULL,
+    source TEXT NOT NULL,
+    date TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (app, source, date)
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    app TEXT NOT NULL,
+    source TEXT NOT NULL,
+    settled_through TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (app, source)
+);
+CREATE TABLE IF NOT EXISTS campaign_ids (
+    customer_id TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    ids TEXT NOT NULL,
+    resolved_at TEXT NOT NULL,
+    last_change TEXT,
+    PRIMARY KEY (customer_id, prefix)
+);
+"""
+
+
+def _shift(date_str, days):
+    return (datetime.strptime(date_str, "%Y-%m-%d") + timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def settled_through(today=None):
+    """Last date (YYYY-MM-DD) considered final as of `today`."""
+    today = today or datetime.today()
+    return (today - timedelta(days=UNSETTLED_DAYS + 1)).strftime("%Y-%m-%d")
+
+
+class MetricsStore:
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+            # Stores created before campaign_ids.last_change existed
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(campaign_ids)")}
+            if "last_change" not in columns:
+                self._conn.execute("ALTER TABLE campaign_ids ADD COLUMN last_change TEXT")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def watermark(self, app, source):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT settled_through FROM watermarks WHERE app = ? AND source = ?",
+                (app, source)
+            ).fetchone()
+        return row[0] if row else None
+
+    def fetch_start(self, app, source, start_date_str):
+        """First date that still has to come from the API for this window."""
+        mark = self.watermark(app, source)
+        if not mark or mark < _shift(start_date_str, -1):
+            # No history, or a gap before the window: fetch the whole window
+            return start_date_str
+        return max(start_date_str, _shift(mark, 1))
+
+    def load(self, app, source, start_date_str, end_date_str):
+        if start_date_str > end_date_str:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT date, data FROM daily_metrics "
+                "WHERE app = ? AND source = ? AND date BETWEEN ? AND ? ORDER BY date",
+                (app, source, start_date_str, end_date_str)
+            ).fetchall()
+        return {date_str: json.loads(data) for date_str, data in rows}
+
+    def history(self, app, source, start_date_str, fetch_start_str):
+        """Stored days from `start` up to (not including) `fetch_start`."""
+        return self.load(app, source, start_date_str, _shift(fetch_start_str, -1))
+
+    def save(self, app, source, daily, start_date_str, end_date_str, today=None):
+        """
+        Replace the stored days in [start, end] with `daily` and move the
+        watermark forward over the days in that range that are now settled.
+        """
+        final_through = min(end_date_str, settled_through(today))
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM daily_metrics WHERE app = ? AND source = ? AND date BETWEEN ? AND ?",
+                (app, source, start_date_str, end_date_str)
+            )
+            self._conn.executemany(
+                "INSERT INTO daily_metrics (app, source, date, data) VALUES (?, ?, ?, ?)",
+                [
+                    (app, source, date_str, json.dumps(value))
+                    for date_str, value in daily.items()
+                    if start_date_str <= date_str <= end_date_str
+                ]
+            )
+            if final_through >= start_date_str:
+                self._conn.execute(
+                    "INSERT INTO watermarks (app, source, settled_through, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(app, source) DO UPDATE SET "
+                    "settled_through = MAX(settled_through, excluded.settled_through), "
+                    "updated_at = excluded.updated_at",
+                    (app, source, final_through, now)
+                )
+
+    def campaign_ids(self, customer_id, prefix):
+        """(ids, resolved_at, last_change) cached for a campaign name prefix, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT ids, resolved_at, last_change FROM campaign_ids WHERE customer_id = ? AND prefix = ?",
+                (str(customer_id), prefix)
+            ).fetchone()
+        if not row:
+            return None
+        return json.loads(row[0]), datetime.fromisoformat(row[1]), row[2]
+
+    def save_campaign_ids(self, customer_id, prefix, ids, resolved_at, last_change=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO campaign_ids (customer_id, prefix, ids, resolved_at, last_change) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (str(customer_id), prefix, json.dumps(list(ids)), resolved_at.isoformat(timespec="seconds"),
+                 last_change)
+            )
+
+    def reset_campaign_ids(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM campaign_ids")
+
+    def reset(self, app=None):
+        with self._lock, self._conn:
+            if app is None:
+                self._conn.execute("DELETE FROM daily_metrics")
+                self._conn.execute("DELETE FROM watermarks")
+                self._conn.execute("DELETE FROM campaign_ids")
+            else:
+                self._conn.execute("DELETE FROM daily_metrics WHERE app = ?", (app,))
+                self._conn.execute("DELETE FROM watermarks WHERE app = ?", (app,))
+
+
+_store = None
+_store_path = DEFAULT_STORE_PATH
+_store_lock = threading.Lock()
+
+
+def configure_store(path=DEFAULT_STORE_PATH):
+    """Point the pipeline at another store file, or pass None to disable it."""
+    global _store, _store_path
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+        _store = None
+        _store_path = path
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None and _store_path:
+            _store = MetricsStore(_store_path)
+        return _store
+
+
+def fetch_with_history(app, sources, start_date_str, end_date_str, fetch, today=None):
+    """
+    Return one daily dict per source for [start, end]: settled days come from
+    the store, the rest from fetch(fetch_start, end), which must return a
+    tuple of daily dicts aligned with `sources`. Fetched days are written back,
+    settled as of the run's `today` (default: now).
+    """
+    store = get_store()
+    if store is None:
+        return fetch(start_date_str, end_date_str)
+    # Sources fetched together share one window, so start from the laggard
+    fetch_start = min(store.fetch_start(app, source, start_date_str) for source in sources)
+    fresh = fetch(fetch_start, end_date_str)
+    merged = []
+    for source, fresh_daily in zip(sources, fresh):
+        daily = store.history(app, source, start_date_str, fetch_start)
+        store.save(app, source, fresh_daily, fetch_start, end_date_str, today)
+        daily.update(fresh_daily)
+        merged.append(daily)
+    return tuple(merged)
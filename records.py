@@ -0,0 +1,214 @@
+import calendar
+from datetime import date, datetime
+from decimal import Decimal, ROUND_HALF_EVEN
+
+# Compact per-day record used from fetch through cleaning to the writers.
+# Money is kept as integer micros and the day as a date ordinal; the string
+# forms ("$12.3", "17-10-2026", "October") are only built at the output edge.
+
+MICROS = 1_000_000
+
+MONTH_NAMES = tuple(calendar.month_name)
+MONTH_NUMBERS = {name: number for number, name in enumerate(MONTH_NAMES) if name}
+
+# Sheet/report column -> record attribute
+MONEY_COLUMNS = {
+    "Gads_Spend": "gads_spend",
+    "Total_spend": "total_spend",
+    "Total New Revenue": "total_revenue",
+    "Ad Revenue": "ad_revenue",
+    "IAP_Revenue": "iap_revenue",
+    "Total Revenue": "total_revenue"
+}
+COUNT_COLUMNS = {
+    "Count of Purchases": "purchases",
+    "Renewal": "renewal",
+    "Renewal_Count": "renewal_count"
+}
+
+
+def to_micros(value):
+    """Dollars (float, int or numeric string) -> integer micros."""
+    if not value:
+        return 0
+    return int((Decimal(str(value)) * MICROS).to_integral_value(ROUND_HALF_EVEN))
+
+
+def from_micros(micros):
+    return micros / MICROS
+
+
+def day_ordinal(date_str):
+    """YYYY-MM-DD or YYYYMMDD -> date ordinal."""
+    if len(date_str) == 8:
+        return date(int(date_str[:4]), int(date_str[4:6]), int(date_str[6:])).toordinal()
+    return date.fromisoformat(date_str).toordinal()
+
+
+def month_sort_key(month_label):
+    """Sort key for "October" or "October 2024" month labels."""
+    name, _, year = month_label.partition(" ")
+    return (int(year) if year.isdigit() else 0, MONTH_NUMBERS.get(name, 0))
+
+
+def sheet_months(col_a):
+    """
+    (year, month) of every month header in a sheet's column A. Headers are
+    "October 2024" (backfills) or just "October" (daily runs); the latter
+    takes its year from the first date row under it.
+    """
+    months = set()
+    waiting = None
+    for cell in col_a:
+        text = str(cell).strip()
+        name, _, year = text.partition(" ")
+        if name in MONTH_NUMBERS and (not year or year.isdigit()):
+            waiting = None
+            if year:
+                months.add((int(year), MONTH_NUMBERS[name]))
+            else:
+                waiting = MONTH_NUMBERS[name]
+        elif waiting and "-" in text:
+            # Dates are written as 17-10-2026 or 2026-10-17
+            years = [int(part) for part in text.split("-") if len(part) == 4 and part.isdigit()]
+            if years:
+                months.add((years[0], waiting))
+            waiting = None
+    return months
+
+
+def format_money(micros):
+    # Same text the cleaning step always produced, e.g. "$12.3"
+    return f"${round(from_micros(micros), 2)}"
+
+
+def percent_fraction(indicator):
+    """"+5.0%" -> 0.05; anything that isn't a percentage (e.g. "N/A") is returned as is."""
+    if isinstance(indicator, str) and indicator.endswith("%"):
+        try:
+            return round(float(indicator[:-1]) / 100, 6)
+        except ValueError:
+            return indicator
+    return indicator
+
+
+class DailyMetrics:
+    __slots__ = (
+        "day", "gads_spend", "total_spend", "total_revenue", "iap_revenue",
+        "purchases", "renewal", "renewal_count", "roas", "roi", "extras"
+    )
+
+    def __init__(self, day, gads_spend=0, total_spend=0, total_revenue=0, iap_revenue=0,
+                 purchases=0, renewal=0, renewal_count=0):
+        self.day = day
+        self.gads_spend = gads_spend
+        self.total_spend = total_spend
+        self.total_revenue = total_revenue
+        self.iap_revenue = iap_revenue
+        self.purchases = purchases
+        self.renewal = renewal
+        self.renewal_count = renewal_count
+        if total_spend > 0:
+            # The old float expression on dollars, so half-cent ties round as before
+            revenue, spend = from_micros(total_revenue), from_micros(total_spend)
+            self.roas = round(revenue / spend, 2) or 0
+            self.roi = round((revenue - spend) / spend, 2) or 0
+        else:
+            self.roas = 0
+            self.roi = 0
+        # Rolling averages and indicators (L3_ROAS, ROAS_Indicator, ...)
+        self.extras = {}
+
+    @property
+    def ad_revenue(self):
+        return self.total_revenue - self.iap_revenue
+
+    @property
+    def date(self):
+        return date.fromordinal(self.day)
+
+    @property
+    def date_str(self):
+        return self.date.isoformat()
+
+    @property
+    def formatted_date(self):
+        d = self.date
+        return f"{d.day}-{d.month}-{d.year}"
+
+    @property
+    def month(self):
+        return MONTH_NAMES[self.date.month]
+
+    @property
+    def month_with_year(self):
+        d = self.date
+        return f"{MONTH_NAMES[d.month]} {d.year}"
+
+    def __repr__(self):
+        return f"DailyMetrics({self.date_str}, spend={self.total_spend}, revenue={self.total_revenue})"
+
+    # Read-only dict view with the historical column names, so report and
+    # sheet code can keep addressing rows as row["Gads_Spend"] etc.
+    def __getitem__(self, key):
+        if key in MONEY_COLUMNS:
+            return from_micros(getattr(self, MONEY_COLUMNS[key]))
+        if key in COUNT_COLUMNS:
+            return getattr(self, COUNT_COLUMNS[key])
+        if key == "ROAS":
+            return self.roas
+        if key == "ROI":
+            return self.roi
+        if key == "Formatted_Date":
+            return self.formatted_date
+        if key == "date_str":
+            return self.date_str
+        if key == "date_obj":
+            return datetime.fromordinal(self.day)
+        if key == "Month":
+            return self.month
+        return self.extras[key]
+
+    def __setitem__(self, key, value):
+        if key == "ROAS":
+            self.roas = value
+        elif key == "ROI":
+            self.roi = value
+        else:
+            self.extras[key] = value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def cleaned(self, column):
+        """Cell value as the cleaning step has always presented it."""
+        if column == "Formatted_Date":
+            return self.formatted_date
+        if column in MONEY_COLUMNS:
+            return format_money(getattr(self, MONEY_COLUMNS[column]))
+        if column in COUNT_COLUMNS:
+            return getattr(self, COUNT_COLUMNS[column])
+        value = self.get(column)
+        if column.endswith("_Indicator"):
+            return str(value) if value is not None else "N/A"
+        return str(value) if isinstance(value, (int, float)) else "N/A"
+
+    def typed(self, column):
+        """
+        Cell value for the sheet writers: money in dollars, counts, ratios and
+        indicators (as fractions) stay numbers; the sheet's number formats
+        render them.
+        """
+        if column == "Formatted_Date":
+            return self.formatted_date
+        if column in MONEY_COLUMNS:
+            return round(from_micros(getattr(self, MONEY_COLUMNS[column])), 2)
+        if column in COUNT_COLUMNS:
+            return getattr(self, COUNT_COLUMNS[column])
+        value = self.get(column)
+        if column.endswith("_Indicator"):
+            return percent_fraction(value) if value is not None else "N/A"
+        return value if isinstance(value, (int, float)) else "N/A"
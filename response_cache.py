@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from telemetry import count
+
+# On-disk cache of parsed API responses shared by every entry point, so a
+# debug print followed by a sheet write (or the app and warehouse writers
+# run back to back) query Ads and GA4 once. Entries are content-addressed:
+# the file name is a hash of the source, the account/property and the
+# normalized query or date range. Each source has its own TTL and the
+# directory is kept under a size cap by evicting the least recently used
+# entries.
+#
+#   RESPONSE_CACHE=on|off|record|replay   (default on)
+#   RESPONSE_CACHE_DIR=response_cache
+#   RESPONSE_CACHE_MAX_MB=256
+#
+# "record" always calls the APIs and keeps every response (nothing expires
+# or is evicted); "replay" only reads, ignoring TTLs, so a recorded run can
+# be reproduced offline. A replay miss raises CacheMiss.
+
+DEFAULT_CACHE_DIR = "response_cache"
+DEFAULT_MAX_BYTES = 256 * 2 ** 20
+# Seconds a response is reused for; short, since recent days still move
+DEFAULT_TTLS = {"gads": 600, "ga4": 600}
+
+MODE_ON = "on"
+MODE_OFF = "off"
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+MODES = (MODE_ON, MODE_OFF, MODE_RECORD, MODE_REPLAY)
+
+_lock = threading.Lock()
+_settings = None
+# file name -> [size, last used]; loaded from the directory on first use
+_index = None
+
+
+class CacheMiss(Exception):
+    """Replay mode was asked for a response that wasn't recorded."""
+
+
+def configure_response_cache(mode=None, path=None, ttls=None, max_bytes=None):
+    """Override the RESPONSE_CACHE* environment settings for this process."""
+    global _settings, _index
+    mode = mode or os.environ.get("RESPONSE_CACHE") or MODE_ON
+    if mode not in MODES:
+        raise ValueError(f"Unknown response cache mode '{mode}', expected one of {', '.join(MODES)}")
+    max_mb = os.environ.get("RESPONSE_CACHE_MAX_MB")
+    with _lock:
+        _settings = {
+            "mode": mode,
+            "path": path or os.environ.get("RESPONSE_CACHE_DIR") or DEFAULT_CACHE_DIR,
+            "ttls": dict(DEFAULT_TTLS, **(ttls or {})),
+            "max_bytes": max_bytes or (int(float(max_mb) * 2 ** 20) if max_mb else DEFAULT_MAX_BYTES)
+        }
+        _index = None
+
+
+def _current():
+    if _settings is None:
+        configure_response_cache()
+    return _settings
+
+
+def cache_mode():
+    return _current()["mode"]
+
+
+def normalize_query(query):
+    """Whitespace-insensitive form of a GAQL query, for cache keys."""
+    return " ".join(query.split())
+
+
+def cache_key(source, key_parts):
+    text = json.dumps([source] + [str(part) for part in key_parts])
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _load_index(path):
+    global _index
+    if _index is None:
+        _index = {}
+        if os.path.isdir(path):
+            for entry in os.scandir(path):
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    _index[entry.name] = [stat.st_size, stat.st_mtime]
+    return _index
+
+
+def _read(settings, name):
+    file_path = os.path.join(settings["path"], name)
+    try:
+        with open(file_path) as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable cache entry {file_path}: {e}")
+        return None
+    now = time.time()
+    try:
+        # Recency for LRU eviction lives in the file's mtime
+        os.utime(file_path, (now, now))
+    except OSError:
+        pass
+    with _lock:
+        indexed = _load_index(settings["path"]).get(name)
+        if indexed:
+            indexed[1] = now
+    return entry
+
+
+def _write(settings, name, source, key_parts, payload):
+    os.makedirs(settings["path"], exist_ok=True)
+    text = json.dumps({"source": source, "key": [str(part) for part in key_parts],
+                       "stored_at": time.time(), "payload": payload})
+    fd, tmp_path = tempfile.mkstemp(dir=settings["path"], prefix=".entry.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, os.path.join(settings["path"], name))
+    except OSError:
+        # The index only tracks .json entries, so a stray temp file would never be evicted
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    with _lock:
+        index = _load_index(settings["path"])
+        index[name] = [len(text), time.time()]
+        if settings["mode"] == MODE_RECORD:
+            return
+        total = sum(size for size, _ in index.values())
+        for old_name, (size, _) in sorted(index.items(), key=lambda item: item[1][1]):
+            if total <= settings["max_bytes"]:
+                break
+            try:
+                os.remove(os.path.join(settings["path"], old_name))
+            except OSError:
+                pass
+            del index[old_name]
+            total -= size
+            count("response_cache_evictions", source=source)
+
+
+def cached_response(source, key_parts, fetch, refresh=False):
+    """
+    fetch()'s JSON-serializable result for (source, key_parts), from the cache
+    when an entry is fresh enough for the mode; a fetched result is stored.
+    With refresh the cache is only read in replay mode: the caller knows the
+    stored response is out of date, so it is fetched and overwritten.
+    Results read back from the cache have been through JSON (tuples are lists).
+    """
+    settings = _current()
+    mode = settings["mode"]
+    if mode == MODE_OFF:
+        return fetch()
+
+    name = cache_key(source, key_parts) + ".json"
+    if mode == MODE_REPLAY or (mode == MODE_ON and not refresh):
+        entry = _read(settings, name)
+        ttl = settings["ttls"].get(source, 0)
+        if entry is not None and (mode == MODE_REPLAY or time.time() - entry["stored_at"] < ttl):
+            count("response_cache_hits", source=source)
+            return entry["payload"]
+        if mode == MODE_REPLAY:
+            raise CacheMiss(f"No recorded {source} response for {key_parts}")
+
+    payload = fetch()
+    count("response_cache_misses", source=source)
+    try:
+        _write(settings, name, source, key_parts, payload)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Could not cache {source} response: {e}")
+    return payload
@@ -0,0 +1,134 @@
+from itertools import accumulate
+
+# Rolling-window averages (L3/L7/L14/...) and day-over-day indicators for any
+# set of windows and metrics, computed in one pass per metric with prefix sums.
+
+DEFAULT_WINDOWS = (3, 7, 14)
+DEFAULT_METRICS = ("ROAS", "ROI")
+
+
+def rolling_windows(app_config=None):
+    windows = (app_config or {}).get("rolling_windows") or DEFAULT_WINDOWS
+    return tuple(sorted({int(w) for w in windows}))
+
+
+def rolling_metrics(app_config=None):
+    return tuple((app_config or {}).get("rolling_metrics") or DEFAULT_METRICS)
+
+
+def history_days(windows=DEFAULT_WINDOWS):
+    """Days of history needed for the longest window (never less than the old 16)."""
+    return max(16, max(windows, default=0) + 2)
+
+
+def average_column(metric, window):
+    return f"L{window}_{metric}"
+
+
+def indicator_column(metric):
+    return f"{metric}_Indicator"
+
+
+def indicator_columns(app_config=None):
+    """ROAS, ROI, L3_ROAS, ..., L14_ROI, ROAS_Indicator, ROI_Indicator for the config."""
+    metrics = rolling_metrics(app_config)
+    windows = rolling_windows(app_config)
+    columns = list(metrics)
+    for metric in metrics:
+        columns.extend(average_column(metric, w) for w in windows)
+    columns.extend(indicator_column(metric) for metric in metrics)
+    return columns
+
+
+def _to_cents(value):
+    # ROAS/ROI are already rounded to 2 decimals, so their sums are exact in
+    # integer cents. Anything else is flagged and summed the legacy way.
+    if value is None:
+        return 0, False
+    cents = round(value * 100)
+    return cents, cents / 100 != value
+
+
+def rolling_averages(values, windows=DEFAULT_WINDOWS):
+    """
+    {window: [average or None, ...]} for every index of `values`.
+
+    Same semantics as the old per-row computation: None until a full window
+    is available, None values are skipped, and the mean of the rest is
+    rounded to 2 decimals (None if the whole window is None).
+    """
+    n = len(values)
+    cents, inexact = zip(*(_to_cents(v) for v in values)) if n else ((), ())
+    sum_prefix = list(accumulate(cents, initial=0))
+    count_prefix = list(accumulate((v is not None for v in values), initial=0))
+    inexact_prefix = list(accumulate(inexact, initial=0))
+    nonzero_prefix = list(accumulate((bool(c) for c in cents), initial=0))
+
+    def _legacy(lo, hi):
+        window_values = [v for v in values[lo:hi] if v is not None]
+        return round(sum(window_values) / len(window_values), 2)
+
+    result = {}
+    for window in windows:
+        averages = [None] * n
+        for i in range(window - 1, n):
+            lo, hi = i - window + 1, i + 1
+            count = count_prefix[hi] - count_prefix[lo]
+            if not count:
+                continue
+            total = sum_prefix[hi] - sum_prefix[lo]
+            quotient, remainder = divmod(total, count)
+            if (inexact_prefix[hi] != inexact_prefix[lo] or 2 * remainder == count
+                    or (total == 0 and nonzero_prefix[hi] != nonzero_prefix[lo])):
+                # Non-cent inputs, an exact half-cent tie, or values cancelling
+                # to zero: float error in the old sum() decides the rounding
+                # (or the sign of zero), so reproduce it literally
+                averages[i] = _legacy(lo, hi)
+                continue
+            rounded = quotient + (2 * remainder > count)
+            averages[i] = rounded / 100 if rounded or total >= 0 else -0.0
+        result[window] = averages
+    return result
+
+
+def change_indicator(current_value, previous_value):
+    if current_value is None or previous_value is None or previous_value == 0:
+        return "N/A"
+    change_percent = ((current_value - previous_value) / previous_value) * 100
+    if change_percent == 0:
+        return "0%"
+    elif change_percent > 0:
+        return f"+{change_percent:.1f}%"
+    else:
+        return f"{change_percent:.1f}%"
+
+
+def change_indicators(values):
+    """Day-over-day % change per index; the first day is always "0%"."""
+    if not values:
+        return []
+    return ["0%"] + [change_indicator(values[i], values[i - 1]) for i in range(1, len(values))]
+
+
+def placeholder_rolling_values(metrics=DEFAULT_METRICS, windows=DEFAULT_WINDOWS):
+    """Zeroed averages and "N/A" indicators for rows made up without GA4 data."""
+    values = {}
+    for metric in metrics:
+        for window in windows:
+            values[average_column(metric, window)] = 0
+    for metric in metrics:
+        values[indicator_column(metric)] = "N/A"
+    return values
+
+
+def apply_rolling_metrics(rows, metrics=DEFAULT_METRICS, windows=DEFAULT_WINDOWS):
+    """Add L{w}_{metric} and {metric}_Indicator to every row (rows sorted by date)."""
+    for metric in metrics:
+        values = [row[metric] for row in rows]
+        averages = rolling_averages(values, windows)
+        indicators = change_indicators(values)
+        for i, row in enumerate(rows):
+            for window in windows:
+                row[average_column(metric, window)] = averages[window][i]
+            row[indicator_column(metric)] = indicators[i]
+    return rows
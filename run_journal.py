@@ -0,0 +1,146 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+# Per-run checkpoints. While a run is journaled, every app's finished stages
+# are recorded as they complete: "fetch" with the fetched Ads/GA4 payload,
+# then each sink it was written to ("app_sheet", "warehouse",
+# "local_warehouse"). A run started again with resume=True skips the sinks
+# an app already reached and cleans from the journaled payload instead of
+# calling the APIs, so recovering from a crash only redoes what was left.
+# Cleaning itself isn't journaled: rebuilding it from the payload is cheap.
+
+DEFAULT_JOURNAL_PATH = "run_journal.db"
+
+FETCH = "fetch"
+APP_SHEET = "app_sheet"
+WAREHOUSE = "warehouse"
+LOCAL_WAREHOUSE = "local_warehouse"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS run_stages (
+    run_id TEXT NOT NULL,
+    app TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    payload TEXT,
+    finished_at TEXT NOT NULL,
+    PRIMARY KEY (run_id, app, stage)
+);
+"""
+
+
+class RunJournal:
+    def __init__(self, path=DEFAULT_JOURNAL_PATH, run_id=None, resume=False):
+        self.path = path
+        self.run_id = run_id or datetime.today().strftime("%Y-%m-%d")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+            row = self._conn.execute("SELECT started_at FROM runs WHERE run_id = ?", (self.run_id,)).fetchone()
+            if row and resume:
+                # A resumed run keeps the original run's date windows
+                self.started_at = datetime.fromisoformat(row[0])
+            else:
+                self.started_at = datetime.today()
+                self._conn.execute("DELETE FROM run_stages WHERE run_id = ?", (self.run_id,))
+                self._conn.execute("INSERT OR REPLACE INTO runs (run_id, started_at) VALUES (?, ?)",
+                                   (self.run_id, self.started_at.isoformat()))
+        self.resumed = bool(row and resume)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def record(self, app, stage, payload=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO run_stages (run_id, app, stage, payload, finished_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.run_id, app, stage, json.dumps(payload) if payload is not None else None,
+                 datetime.now().isoformat())
+            )
+
+    def done(self, app, stage):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM run_stages WHERE run_id = ? AND app = ? AND stage = ?", (self.run_id, app, stage)
+            ).fetchone()
+        return row is not None
+
+    def completed(self, stage):
+        """{app: payload} for every app that finished `stage` in this run."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT app, payload FROM run_stages WHERE run_id = ? AND stage = ?", (self.run_id, stage)
+            ).fetchall()
+        return {app: json.loads(payload) if payload is not None else None for app, payload in rows}
+
+    def summary(self):
+        """{stage: number of apps that finished it}."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT stage, COUNT(*) FROM run_stages WHERE run_id = ? GROUP BY stage", (self.run_id,)
+            ).fetchall()
+        return dict(rows)
+
+
+_lock = threading.Lock()
+_journal = None
+
+
+def pending_apps(app_names, stage):
+    """The apps of `app_names` that haven't finished `stage` in the active run (all of them if none)."""
+    journal = get_journal()
+    if journal is None:
+        return list(app_names)
+    finished = journal.completed(stage)
+    pending = [app for app in app_names if app not in finished]
+    if len(pending) < len(app_names):
+        print(f"Skipping {len(app_names) - len(pending)} app(s) already through '{stage}' in run '{journal.run_id}'")
+    return pending
+
+
+def mark_done(app, stage):
+    """Record that `app` finished `stage`, if the run is journaled."""
+    journal = get_journal()
+    if journal is not None:
+        journal.record(app, stage)
+
+
+def start_run(run_id=None, resume=False, path=DEFAULT_JOURNAL_PATH):
+    """Journal this process's run from now on; with resume, pick up where run_id left off."""
+    global _journal
+    with _lock:
+        if _journal is not None:
+            _journal.close()
+        _journal = RunJournal(path, run_id, resume)
+    if _journal.resumed:
+        print(f"Resuming run '{_journal.run_id}' started {_journal.started_at:%Y-%m-%d %H:%M}: "
+              f"{_journal.summary() or 'nothing finished yet'}")
+    return _journal
+
+
+def get_journal():
+    """The active journal, or None when the run isn't journaled."""
+    with _lock:
+        return _journal
+
+
+def run_started_at():
+    """When the active run started (a resumed run keeps its original start), else now."""
+    journal = get_journal()
+    return journal.started_at if journal is not None else datetime.today()
+
+
+def end_run():
+    global _journal
+    with _lock:
+        if _journal is not None:
+            _journal.close()
+        _journal = None
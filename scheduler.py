@@ -0,0 +1,264 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from concurrency import api_slot
+from telemetry import count, current_app, observe
+
+# Every Google API call goes through call_api(): it waits for a token from
+# the per-API bucket and the per-property/account bucket, holds a concurrency
+# slot, retries retryable errors with exponential backoff and jitter, and can
+# optionally hedge slow idempotent reads.
+
+# (requests per second, burst) per API
+DEFAULT_RATES = {
+    "gads": (10.0, 20),
+    "ga4": (10.0, 10),
+    "sheets": (1.0, 5)
+}
+# Per property (GA4), customer (Ads) or spreadsheet (Sheets)
+DEFAULT_SCOPE_RATES = {
+    "gads": (5.0, 10),
+    "ga4": (2.0, 5),
+    "sheets": (1.0, 3)
+}
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# GA4: slow a property down once less than this share of its hourly tokens is left
+GA4_QUOTA_LOW_WATER = 0.2
+
+_RETRYABLE_CODES = {"RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED", "INTERNAL", "ABORTED"}
+_RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+_QUOTA_CODES = {"RESOURCE_EXHAUSTED"}
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.base_rate = float(rate)
+        self.rate = float(rate)
+        self.ceiling = float(rate)
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_for = (1 - self.tokens) / self.rate
+            time.sleep(wait_for)
+
+    def scale(self, factor):
+        """Set the rate to a share of the configured one (GA4 quota feedback)."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.ceiling = max(self.base_rate * factor, 0.01)
+            self.rate = min(self.rate, self.ceiling)
+
+    def backoff(self):
+        # Multiplicative decrease on a quota error...
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.rate * 0.5, 0.01)
+
+    def recover(self):
+        # ...additive increase on each success, up to the current ceiling
+        with self.lock:
+            if self.rate < self.ceiling:
+                self.rate = min(self.ceiling, self.rate + self.base_rate * 0.05)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_rates = dict(DEFAULT_RATES)
+_scope_rates = dict(DEFAULT_SCOPE_RATES)
+_hedge_delays = {}
+_hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+_stats = {"calls": 0, "retries": 0, "hedged": 0, "hedge_wins": 0, "throttled_scopes": 0}
+_stats_lock = threading.Lock()
+
+
+def configure_rates(api, rate=None, burst=None, scope_rate=None, scope_burst=None):
+    with _buckets_lock:
+        if rate is not None or burst is not None:
+            old_rate, old_burst = _rates.get(api, (1.0, 1))
+            _rates[api] = (rate or old_rate, burst or old_burst)
+        if scope_rate is not None or scope_burst is not None:
+            old_rate, old_burst = _scope_rates.get(api, (1.0, 1))
+            _scope_rates[api] = (scope_rate or old_rate, scope_burst or old_burst)
+        for key in [k for k in _buckets if k[0] == api]:
+            del _buckets[key]
+
+
+def configure_hedging(api, delay=None):
+    """Send a duplicate of idempotent `api` reads still running after `delay` seconds (None disables)."""
+    with _buckets_lock:
+        if delay is None:
+            _hedge_delays.pop(api, None)
+        else:
+            _hedge_delays[api] = float(delay)
+
+
+def _bucket(api, scope=None):
+    key = (api, scope)
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            rate, burst = (_scope_rates if scope is not None else _rates).get(api, (1.0, 1))
+            bucket = TokenBucket(rate, burst)
+            _buckets[key] = bucket
+        return bucket
+
+
+def _bump(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def error_code(exc):
+    """gRPC status name or HTTP status code of an API error, if it has one."""
+    # GoogleAdsException wraps the grpc call in .error
+    grpc_error = getattr(exc, "error", None)
+    code = getattr(grpc_error, "code", None) or getattr(exc, "code", None)
+    if callable(code):
+        try:
+            code = code()
+        except Exception:
+            code = None
+    if code is not None and hasattr(code, "name"):
+        return code.name
+    if isinstance(code, int):
+        return code
+    # gspread APIError / requests HTTPError
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if isinstance(status, int):
+        return status
+    grpc_status = getattr(exc, "grpc_status_code", None)
+    return getattr(grpc_status, "name", None)
+
+
+def is_retryable(exc, idempotent=True):
+    code = error_code(exc)
+    if not idempotent:
+        # A write may already have landed after a 5xx; only retry outright rejections
+        return code in _QUOTA_CODES or code == 429
+    return code in _RETRYABLE_CODES or code in _RETRYABLE_STATUS
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def _attempt(api, scope, app, fn, args, kwargs):
+    _bucket(api).acquire()
+    if scope is not None:
+        _bucket(api, scope).acquire()
+    count("api_calls", api=api, app=app)
+    with api_slot(api):
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            observe("api_request_seconds", time.perf_counter() - started, api=api, app=app)
+    if scope is not None:
+        _bucket(api, scope).recover()
+    return result
+
+
+def _hedged(api, scope, app, fn, args, kwargs, delay):
+    primary = _hedge_pool.submit(_attempt, api, scope, app, fn, args, kwargs)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+    _bump("hedged")
+    backup = _hedge_pool.submit(_attempt, api, scope, app, fn, args, kwargs)
+    done, _ = wait([primary, backup], return_when=FIRST_COMPLETED)
+    winner = done.pop()
+    if winner is backup:
+        _bump("hedge_wins")
+    # If the first finisher failed, fall back to the other one
+    if winner.exception() is not None:
+        other = backup if winner is primary else primary
+        return other.result()
+    return winner.result()
+
+
+def call_api(api, fn, *args, scope=None, idempotent=True, hedge=None, **kwargs):
+    """
+    Run fn(*args, **kwargs) as one `api` request ("gads", "ga4", "sheets").
+    `scope` is the property/customer/spreadsheet for the second token bucket.
+    Writes must pass idempotent=False; they are never hedged.
+    """
+    hedge_delay = _hedge_delays.get(api) if hedge is None else hedge
+    if not idempotent:
+        hedge_delay = None
+    scope = str(scope) if scope is not None else None
+    # Hedges run on pool threads, so the app label is captured here
+    app = current_app()
+
+    attempt = 0
+    while True:
+        _bump("calls")
+        try:
+            if hedge_delay:
+                return _hedged(api, scope, app, fn, args, kwargs, hedge_delay)
+            return _attempt(api, scope, app, fn, args, kwargs)
+        except Exception as e:
+            if attempt >= MAX_RETRIES or not is_retryable(e, idempotent):
+                count("api_errors", api=api, app=app, code=error_code(e))
+                raise
+            count("api_retries", api=api, app=app, code=error_code(e))
+            if scope is not None and error_code(e) in _QUOTA_CODES | {429}:
+                # Back the whole scope off, not just this caller
+                _bucket(api, scope).backoff()
+            delay = backoff_delay(attempt)
+            attempt += 1
+            _bump("retries")
+            print(f"{api} request failed ({error_code(e)}), retry {attempt}/{MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def observe_ga4_quota(property_id, property_quota):
+    """
+    Adapt the property's request rate to what GA4 says is left of its hourly
+    token quota (response.property_quota when return_property_quota is set).
+    """
+    hourly = getattr(property_quota, "tokens_per_hour", None) if property_quota else None
+    if hourly is None:
+        return
+    consumed = getattr(hourly, "consumed", 0) or 0
+    remaining = getattr(hourly, "remaining", 0) or 0
+    total = consumed + remaining
+    if total <= 0:
+        return
+    share_left = remaining / total
+    factor = 1.0 if share_left >= GA4_QUOTA_LOW_WATER else max(share_left / GA4_QUOTA_LOW_WATER, 0.05)
+    if factor < 1.0:
+        _bump("throttled_scopes")
+    _bucket("ga4", str(property_id)).scale(factor)
+
+
+def scheduler_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def print_scheduler_stats():
+    stats = scheduler_stats()
+    print(f"Scheduler: {stats['calls']} call(s), {stats['retries']} retried, "
+          f"{stats['hedged']} hedged ({stats['hedge_wins']} won by the hedge), "
+          f"{stats['throttled_scopes']} quota slow-down(s)")
@@ -0,0 +1,129 @@
+import json
+import os
+import tempfile
+import threading
+from scheduler import call_api
+from sheet_writer import updated_rows
+from telemetry import count, payload_bytes, stage
+
+# Local sidecar copy of column A for every worksheet we write to, so the
+# writers don't have to download the whole column on each run. Before the
+# copy is trusted, a two-cell read checks that the sheet still ends where the
+# index says it does; if not, the column is scanned once and the index rebuilt.
+
+DEFAULT_INDEX_PATH = "sheet_index.json"
+
+_lock = threading.Lock()
+_index_path = DEFAULT_INDEX_PATH
+_entries = None
+_stats = {"index_hits": 0, "full_scans": 0}
+
+
+def configure_index(path=DEFAULT_INDEX_PATH):
+    """Use another manifest file, or pass None to always scan column A."""
+    global _index_path, _entries
+    with _lock:
+        _index_path = path
+        _entries = None
+
+
+def _key(sheet_id, sheet_name):
+    return f"{sheet_id}/{sheet_name}"
+
+
+def _load():
+    global _entries
+    if _entries is None:
+        _entries = {}
+        if _index_path and os.path.exists(_index_path):
+            try:
+                with open(_index_path) as f:
+                    _entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable sheet index {_index_path}: {e}")
+    return _entries
+
+
+def _save():
+    if not _index_path:
+        return
+    directory = os.path.dirname(os.path.abspath(_index_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".sheet_index.")
+    with os.fdopen(fd, "w") as f:
+        json.dump(_entries, f)
+    os.replace(tmp_path, _index_path)
+
+
+def _matches_sheet(worksheet, sheet_id, col_a):
+    # The last non-empty cell of column A must be where we left it, with
+    # nothing below it
+    last_row = len(col_a)
+    if last_row == 0:
+        values = call_api("sheets", worksheet.get, "A1:A2", scope=sheet_id)
+        return not values
+    values = call_api("sheets", worksheet.get, f"A{last_row}:A{last_row + 1}", scope=sheet_id)
+    return [[str(cell) for cell in row] for row in values] == [[str(col_a[-1])]]
+
+
+def read_column_a(worksheet, sheet_id, sheet_name):
+    """Column A values of `worksheet`, from the index when it is consistent."""
+    key = _key(sheet_id, sheet_name)
+    with _lock:
+        cached = _load().get(key) if _index_path else None
+
+    with stage("sheet_read", sheet=sheet_name):
+        if cached is not None and _matches_sheet(worksheet, sheet_id, cached):
+            with _lock:
+                _stats["index_hits"] += 1
+            count("sheet_index_hits")
+            return list(cached)
+        col_a = call_api("sheets", worksheet.col_values, 1, scope=sheet_id)
+    count("bytes_received", payload_bytes(col_a), api="sheets")
+    count("rows", len(col_a), stage="sheet_read")
+    with _lock:
+        _stats["full_scans"] += 1
+        if _index_path:
+            _load()[key] = list(col_a)
+            _save()
+    return col_a
+
+
+def record_append(sheet_id, sheet_name, col_a_before, rows, responses):
+    """
+    Update the index after `rows` were appended. `responses` are the
+    values.append responses; their updatedRange bounds say where each chunk
+    of rows landed (updatedRows can leave out blank rows, so it isn't used).
+    Without it the entry is dropped and the next run rescans.
+    """
+    key = _key(sheet_id, sheet_name)
+    col_a = list(col_a_before)
+    offset = 0
+    try:
+        for response in responses:
+            start_row, end_row = updated_rows(response)
+            chunk = rows[offset:offset + end_row - start_row + 1]
+            offset += len(chunk)
+            if len(col_a) < start_row - 1:
+                col_a.extend([""] * (start_row - 1 - len(col_a)))
+            del col_a[start_row - 1:]
+            col_a.extend(str(row[0]) if row and row[0] is not None else "" for row in chunk)
+        # Trailing blanks aren't returned by col_values, so don't keep them
+        while col_a and not str(col_a[-1]).strip():
+            col_a.pop()
+    except (KeyError, TypeError, AttributeError, ValueError):
+        col_a = None
+
+    with _lock:
+        if not _index_path:
+            return
+        entries = _load()
+        if col_a is None:
+            entries.pop(key, None)
+        else:
+            entries[key] = col_a
+        _save()
+
+
+def index_stats():
+    with _lock:
+        return dict(_stats)
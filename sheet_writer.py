@@ -0,0 +1,255 @@
+import re
+import threading
+from records import COUNT_COLUMNS, MONEY_COLUMNS
+from scheduler import call_api
+from telemetry import count, payload_bytes, stage
+
+# Sheets writes go out as whole blocks through values.append (append_rows),
+# split so no single request gets near the API payload limits. Rows that
+# are already in the sheet are fixed in place by diffing them against the
+# sheet and sending only the changed cells in one values.batchUpdate.
+# Cells are written as numbers; a block's currency/percent/ratio display
+# comes from number formats applied to the rows it landed on.
+
+# Google recommends keeping request bodies around 2 MB; at our cell sizes
+# this many cells per request stays well below that
+MAX_CELLS_PER_REQUEST = 40_000
+MAX_ROWS_PER_REQUEST = 5_000
+
+# Record columns of a daily row, in sheet order; the rolling columns follow
+DAILY_COLUMNS = (
+    "Formatted_Date", "Gads_Spend", "Total_spend", "Total New Revenue", "Ad Revenue",
+    "IAP_Revenue", "Count of Purchases", "Renewal", "Renewal_Count", "Total Revenue"
+)
+
+CURRENCY_FORMAT = {"type": "CURRENCY", "pattern": "$#,##0.00"}
+PERCENT_FORMAT = {"type": "PERCENT", "pattern": "+0.0%;-0.0%;0%"}
+RATIO_FORMAT = {"type": "NUMBER", "pattern": "0.00"}
+
+_UPDATED_RANGE = re.compile(r"!?[A-Z]+(\d+)(?::[A-Z]+(\d+))?$")
+
+_totals = {"api_calls": 0, "calls_saved": 0, "cells": 0, "rows": 0}
+_totals_lock = threading.Lock()
+
+
+def chunk_rows(rows, max_cells=MAX_CELLS_PER_REQUEST, max_rows=MAX_ROWS_PER_REQUEST):
+    chunk = []
+    cells = 0
+    for row in rows:
+        row_cells = max(len(row), 1)
+        if chunk and (cells + row_cells > max_cells or len(chunk) >= max_rows):
+            yield chunk
+            chunk = []
+            cells = 0
+        chunk.append(row)
+        cells += row_cells
+    if chunk:
+        yield chunk
+
+
+def _spreadsheet_id(worksheet):
+    spreadsheet = getattr(worksheet, "spreadsheet", None)
+    return getattr(spreadsheet, "id", None)
+
+
+def number_formats(columns):
+    """{column number: number format} for rows laid out as `columns` (record column names)."""
+    formats = {}
+    for number, column in enumerate(columns, start=1):
+        if column in MONEY_COLUMNS:
+            formats[number] = CURRENCY_FORMAT
+        elif column.endswith("_Indicator"):
+            formats[number] = PERCENT_FORMAT
+        elif column not in COUNT_COLUMNS and column != "Formatted_Date":
+            formats[number] = RATIO_FORMAT
+    return formats
+
+
+def format_rows(worksheet, first_row, last_row, formats):
+    """
+    Apply `formats` ({column number: numberFormat}) to rows first_row..last_row
+    in one spreadsheets.batchUpdate: a repeatCell per run of adjacent columns
+    sharing a format.
+    """
+    requests = []
+    columns = sorted(formats)
+    run_start = 0
+    for i, column in enumerate(columns):
+        last = i + 1 == len(columns)
+        if last or columns[i + 1] != column + 1 or formats[columns[i + 1]] != formats[column]:
+            requests.append({"repeatCell": {
+                "range": {
+                    "sheetId": worksheet.id,
+                    "startRowIndex": first_row - 1, "endRowIndex": last_row,
+                    "startColumnIndex": columns[run_start] - 1, "endColumnIndex": column
+                },
+                "cell": {"userEnteredFormat": {"numberFormat": formats[column]}},
+                "fields": "userEnteredFormat.numberFormat"
+            }})
+            run_start = i + 1
+    if not requests:
+        return 0
+    # Setting the same format twice is harmless, so retries are safe
+    with stage("sheet_format"):
+        call_api("sheets", worksheet.spreadsheet.batch_update, {"requests": requests},
+                 scope=_spreadsheet_id(worksheet))
+    count("bytes_sent", payload_bytes(requests), api="sheets")
+    return 1
+
+
+def updated_rows(response):
+    """(first, last) sheet row a values.append response's updatedRange covers."""
+    match = _UPDATED_RANGE.search(response["updates"]["updatedRange"])
+    return int(match.group(1)), int(match.group(2) or match.group(1))
+
+
+def _appended_rows(responses):
+    # (first, last) sheet row the append responses' updatedRange covered
+    first = last = None
+    for response in responses:
+        start, end = updated_rows(response)
+        first = start if first is None else min(first, start)
+        last = end if last is None else max(last, end)
+    return first, last
+
+
+def append_block(worksheet, rows, max_cells=MAX_CELLS_PER_REQUEST, max_rows=MAX_ROWS_PER_REQUEST,
+                 formats=None):
+    """
+    Append `rows` to the end of `worksheet` in as few requests as possible,
+    then apply `formats` (see number_formats) to the rows they landed on.
+
+    Returns a stats dict: api_calls made, calls_saved versus one append_row
+    per row, cells and rows written, plus the raw API responses.
+    """
+    stats = {"api_calls": 0, "calls_saved": 0, "cells": 0, "rows": 0}
+    responses = []
+    for chunk in chunk_rows(rows, max_cells, max_rows):
+        # Appends aren't idempotent: only retried when the API rejected them outright
+        with stage("sheet_write"):
+            responses.append(call_api("sheets", worksheet.append_rows, chunk,
+                                      scope=_spreadsheet_id(worksheet), idempotent=False))
+        count("bytes_sent", payload_bytes(chunk), api="sheets")
+        count("rows", len(chunk), stage="sheet_write")
+        stats["api_calls"] += 1
+        stats["rows"] += len(chunk)
+        stats["cells"] += sum(len(row) for row in chunk)
+
+    if formats and responses:
+        try:
+            first, last = _appended_rows(responses)
+        except (KeyError, TypeError, AttributeError):
+            print("Append response has no updatedRange; number formats not applied")
+        else:
+            stats["api_calls"] += format_rows(worksheet, first, last, formats)
+    stats["calls_saved"] = stats["rows"] - stats["api_calls"]
+
+    with _totals_lock:
+        for key, value in stats.items():
+            _totals[key] += value
+    stats["responses"] = responses
+    return stats
+
+
+def column_letter(number):
+    """1 -> A, 27 -> AA."""
+    letters = ""
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def _same_cell(old, new):
+    # Unformatted reads give numbers back as numbers and drop trailing zeros
+    if old == new or str(old) == str(new):
+        return True
+    try:
+        return float(old) == float(new)
+    except (TypeError, ValueError):
+        return False
+
+
+def changed_ranges(number, old, new):
+    """
+    values.batchUpdate data for the cells of sheet row `number` where `new`
+    differs from `old`; each run of adjacent changed cells is one range.
+    """
+    data = []
+    run_start = None
+    for column in range(len(new) + 1):
+        changed = column < len(new) and not _same_cell(old[column] if column < len(old) else "", new[column])
+        if changed and run_start is None:
+            run_start = column
+        elif not changed and run_start is not None:
+            data.append({
+                "range": f"{column_letter(run_start + 1)}{number}:{column_letter(column)}{number}",
+                "values": [list(new[run_start:column])]
+            })
+            run_start = None
+    return data
+
+
+def update_changed_rows(worksheet, rows_by_number, formats=None):
+    """
+    Rewrite rows that are already in `worksheet` ({sheet row: values from
+    column A}) with one read of the rows' span and one batch_update of
+    just the cells that changed; `formats` are applied to that span if
+    anything changed. Returns api_calls, rows and cells written, and
+    cells_saved versus rewriting those rows in full.
+    """
+    stats = {"api_calls": 0, "calls_saved": 0, "cells": 0, "rows": 0}
+    if not rows_by_number:
+        return stats
+    scope = _spreadsheet_id(worksheet)
+    first, last = min(rows_by_number), max(rows_by_number)
+    width = max(len(row) for row in rows_by_number.values())
+    with stage("sheet_read"):
+        current = call_api("sheets", worksheet.get, f"A{first}:{column_letter(width)}{last}",
+                           value_render_option="UNFORMATTED_VALUE", scope=scope)
+    count("bytes_received", payload_bytes(current), api="sheets")
+    stats["api_calls"] += 1
+
+    data = []
+    for number in sorted(rows_by_number):
+        offset = number - first
+        old = current[offset] if offset < len(current) else []
+        row_changes = changed_ranges(number, old, rows_by_number[number])
+        if row_changes:
+            data.extend(row_changes)
+            stats["rows"] += 1
+    if data:
+        # Writing the same values to the same cells again is harmless, so retries are safe
+        with stage("sheet_write"):
+            call_api("sheets", worksheet.batch_update, data, value_input_option="RAW", scope=scope)
+        count("bytes_sent", payload_bytes(data), api="sheets")
+        stats["api_calls"] += 1
+        stats["cells"] = sum(len(item["values"][0]) for item in data)
+        count("rows", stats["rows"], stage="sheet_update")
+        if formats:
+            # Rows written before values were typed have no number formats yet
+            stats["api_calls"] += format_rows(worksheet, first, last, formats)
+    # Versus rewriting every row of the window in full
+    stats["cells_saved"] = sum(len(row) for row in rows_by_number.values()) - stats["cells"]
+
+    with _totals_lock:
+        for key in ("api_calls", "cells", "rows"):
+            _totals[key] += stats[key]
+    return stats
+
+
+def write_totals():
+    with _totals_lock:
+        return dict(_totals)
+
+
+def reset_write_totals():
+    with _totals_lock:
+        for key in _totals:
+            _totals[key] = 0
+
+
+def print_write_totals():
+    totals = write_totals()
+    print(f"Sheets: {totals['rows']} row(s), {totals['cells']} cell(s) written in "
+          f"{totals['api_calls']} call(s), {totals['calls_saved']} call(s) saved")
@@ -0,0 +1,195 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-run instrumentation: stage latency histograms per app, API call/retry/
+# error counters, rows processed and bytes transferred. Exported at the end
+# of a run as a Prometheus textfile (for node_exporter's textfile collector)
+# and/or a JSON run summary:
+#
+#   METRICS_TEXTFILE=/var/lib/node_exporter/automation.prom
+#   METRICS_JSON=run_metrics.json
+
+METRICS_PREFIX = "automation"
+HISTOGRAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_lock = threading.Lock()
+_context = threading.local()
+_histograms = {}
+_counters = {}
+_run_started = time.time()
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def current_app():
+    return getattr(_context, "app", None)
+
+
+@contextmanager
+def app_context(app):
+    """Attribute API calls made by this thread to `app` until the block ends."""
+    previous = current_app()
+    _context.app = app
+    try:
+        yield
+    finally:
+        _context.app = previous
+
+
+def observe(name, seconds, **labels):
+    labels.setdefault("app", current_app())
+    key = (name, _labels_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {
+                "buckets": [0] * len(HISTOGRAM_BUCKETS), "count": 0, "sum": 0.0, "max": 0.0
+            }
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][i] += 1
+        histogram["count"] += 1
+        histogram["sum"] += seconds
+        histogram["max"] = max(histogram["max"], seconds)
+
+
+def count(name, value=1, **labels):
+    labels.setdefault("app", current_app())
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+@contextmanager
+def stage(name, app=None, **labels):
+    """
+    Time a pipeline stage ("gads_query", "ga4_report", "clean", "sheet_read",
+    ...). The app defaults to the one set by app_context(); failures are
+    counted under stage_errors.
+    """
+    app = app if app is not None else current_app()
+    started = time.perf_counter()
+    try:
+        if app is not None:
+            with app_context(app):
+                yield
+        else:
+            yield
+    except Exception:
+        count("stage_errors", stage=name, app=app, **labels)
+        raise
+    finally:
+        observe("stage_seconds", time.perf_counter() - started, stage=name, app=app, **labels)
+
+
+def payload_bytes(obj):
+    """Serialized size of an API payload: protobuf size if it has one, else its JSON size."""
+    try:
+        if hasattr(type(obj), "pb"):
+            return type(obj).pb(obj).ByteSize()
+        if hasattr(obj, "ByteSize"):
+            return obj.ByteSize()
+        return len(json.dumps(obj, default=str))
+    except Exception:
+        return 0
+
+
+def reset_metrics():
+    global _run_started
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _run_started = time.time()
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + list(extra or [])
+    if not pairs:
+        return ""
+    escaped = ((k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def prometheus_text():
+    lines = []
+    with _lock:
+        histograms = sorted(_histograms.items())
+        counters = sorted(_counters.items())
+        run_started = _run_started
+
+    typed = set()
+    for (name, labels), histogram in histograms:
+        metric = f"{METRICS_PREFIX}_{name}"
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} histogram")
+            typed.add(metric)
+        for bound, bucket_count in zip(HISTOGRAM_BUCKETS, histogram["buckets"]):
+            lines.append(f"{metric}_bucket{_format_labels(labels, [('le', str(bound))])} {bucket_count}")
+        lines.append(f"{metric}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+        lines.append(f"{metric}_sum{_format_labels(labels)} {histogram['sum']:.6f}")
+        lines.append(f"{metric}_count{_format_labels(labels)} {histogram['count']}")
+
+    for (name, labels), value in counters:
+        metric = f"{METRICS_PREFIX}_{name}_total"
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} counter")
+            typed.add(metric)
+        lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+    lines.append(f"# TYPE {METRICS_PREFIX}_last_run_timestamp_seconds gauge")
+    lines.append(f"{METRICS_PREFIX}_last_run_timestamp_seconds {run_started:.0f}")
+    lines.append(f"# TYPE {METRICS_PREFIX}_last_run_duration_seconds gauge")
+    lines.append(f"{METRICS_PREFIX}_last_run_duration_seconds {time.time() - run_started:.3f}")
+    return "\n".join(lines) + "\n"
+
+
+def run_summary():
+    """JSON-ready summary: one entry per (metric, labels), slowest stages first."""
+    with _lock:
+        histograms = list(_histograms.items())
+        counters = list(_counters.items())
+        run_started = _run_started
+
+    stages = [
+        dict(dict(labels), metric=name, count=h["count"], total_s=round(h["sum"], 6),
+             mean_s=round(h["sum"] / h["count"], 6) if h["count"] else 0.0, max_s=round(h["max"], 6))
+        for (name, labels), h in histograms
+    ]
+    stages.sort(key=lambda s: s["total_s"], reverse=True)
+    return {
+        "started": run_started,
+        "duration_s": round(time.time() - run_started, 3),
+        "timings": stages,
+        "counters": [dict(dict(labels), metric=name, value=value) for (name, labels), value in sorted(counters)]
+    }
+
+
+def _atomic_write(path, text):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".metrics.")
+    try:
+        # mkstemp files are owner-only; node_exporter usually runs as another user
+        os.chmod(tmp_path, 0o644)
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def export_metrics(textfile=None, json_path=None):
+    """Write the Prometheus textfile and/or JSON summary (paths default to METRICS_TEXTFILE / METRICS_JSON)."""
+    textfile = textfile or os.environ.get("METRICS_TEXTFILE")
+    json_path = json_path or os.environ.get("METRICS_JSON")
+    if textfile:
+        _atomic_write(textfile, prometheus_text())
+    if json_path:
+        _atomic_write(json_path, json.dumps(run_summary(), indent=2))
@@ -0,0 +1,120 @@
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from telemetry import count
+
+# OAuth access tokens persisted between runs. Entries are keyed by a hash
+# of the credential identity and scopes (never the secrets themselves) and
+# reused until shortly before they expire, so an ordinary run skips the
+# refresh-token / JWT exchanges entirely. The file holds live bearer
+# tokens, so it is created owner-only (0600).
+
+DEFAULT_TOKEN_CACHE_PATH = "token_cache.json"
+# Refresh this long before the real expiry; google-auth itself treats
+# tokens within ~4 minutes of expiry as stale
+EXPIRY_MARGIN = timedelta(minutes=5)
+
+_lock = threading.Lock()
+_cache_path = DEFAULT_TOKEN_CACHE_PATH
+_entries = None
+
+
+def configure_token_cache(path=DEFAULT_TOKEN_CACHE_PATH):
+    """Use another cache file, or pass None to keep tokens in memory only."""
+    global _cache_path, _entries
+    with _lock:
+        _cache_path = path
+        _entries = None
+
+
+def _utcnow():
+    # google-auth keeps expiry as a naive UTC datetime
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _read_file():
+    if not _cache_path or not os.path.exists(_cache_path):
+        return {}
+    try:
+        with open(_cache_path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable token cache {_cache_path}: {e}")
+        return {}
+
+
+def _load():
+    global _entries
+    if _entries is None:
+        _entries = _read_file()
+    return _entries
+
+
+def _save():
+    if not _cache_path:
+        return
+    # Merge with what other processes wrote since we loaded, dropping expired tokens
+    merged = _read_file()
+    merged.update(_entries)
+    now = _utcnow()
+    merged = {
+        key: entry for key, entry in merged.items()
+        if datetime.fromisoformat(entry["expiry"]) > now
+    }
+    directory = os.path.dirname(os.path.abspath(_cache_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".token_cache.")
+    try:
+        os.chmod(tmp_path, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(merged, f)
+        os.replace(tmp_path, _cache_path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_token(key):
+    """(token, expiry) if a cached token is still good for a while, else None."""
+    with _lock:
+        entry = _load().get(key)
+    if not entry:
+        return None
+    expiry = datetime.fromisoformat(entry["expiry"])
+    if expiry - EXPIRY_MARGIN <= _utcnow():
+        return None
+    return entry["token"], expiry
+
+
+def store_token(key, token, expiry):
+    if not token or expiry is None:
+        return
+    with _lock:
+        _load()[key] = {"token": token, "expiry": expiry.isoformat()}
+        try:
+            _save()
+        except OSError as e:
+            print(f"Could not write token cache {_cache_path}: {e}")
+
+
+def attach(credentials, key, kind):
+    """
+    Seed google-auth `credentials` with a cached token and persist every
+    token it refreshes from now on. Returns the same credentials object.
+    """
+    cached = load_token(key)
+    if cached is not None:
+        credentials.token, credentials.expiry = cached
+        count("token_cache_hits", kind=kind)
+
+    refresh = credentials.refresh
+
+    def _refresh_and_store(request):
+        refresh(request)
+        count("token_exchanges", kind=kind)
+        store_token(key, credentials.token, credentials.expiry)
+
+    credentials.refresh = _refresh_and_store
+    return credentials
@@ -0,0 +1,319 @@
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from telemetry import count, export_metrics, stage
+
+# Shares one run over several worker processes / machines. The apps of a run
+# are enqueued once; each worker claims a few at a time under a lease, keeps
+# the lease alive with a heartbeat while it fetches, cleans and writes them,
+# and marks them done. A worker that dies simply stops renewing: once its
+# lease expires the apps are claimable again.
+#
+# An app is only written while its lease is held. Right before writing, the
+# worker renews its leases and drops any app it no longer owns, so an app
+# taken over after an expiry is written by its new owner only. The writers
+# skip dates already in the sheet, so an app that is re-run after a crash
+# mid-write doesn't get its rows twice either.
+#
+#   python work_queue.py enqueue --run-id 2026-10-18
+#   python work_queue.py work --run-id 2026-10-18 --write both    # on each node
+#   python work_queue.py status --run-id 2026-10-18
+#
+# The queue is a SQLite file; point every worker at the same one (a local
+# disk for workers on one machine, or a shared path for several).
+
+DEFAULT_QUEUE_PATH = "work_queue.db"
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_BATCH_SIZE = 5
+# An app that failed this many times is left as failed instead of retried
+MAX_ATTEMPTS = 3
+# While other workers hold leases, look for expired ones this often
+IDLE_POLL_SECONDS = 15
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS work_items (
+    run_id TEXT NOT NULL,
+    app TEXT NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (run_id, app)
+);
+"""
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class WorkQueue:
+    def __init__(self, path=DEFAULT_QUEUE_PATH, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        # Autocommit, so claims can take the write lock up front with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def enqueue(self, run_id, app_names):
+        """Add the run's apps; apps already queued for the run are left as they are."""
+        now = time.time()
+        rows = [(run_id, app, PENDING, now) for app in app_names]
+        return self._transaction(lambda conn: conn.executemany(
+            "INSERT OR IGNORE INTO work_items (run_id, app, status, updated_at) VALUES (?, ?, ?, ?)", rows
+        ).rowcount)
+
+    def claim(self, run_id, worker, limit=1):
+        """Lease up to `limit` pending (or expired) apps of the run to `worker`."""
+        def _claim(conn):
+            now = time.time()
+            # Leases that ran out on their last attempt won't be retried
+            conn.execute(
+                "UPDATE work_items SET status = ?, worker = NULL, lease_expires = NULL, "
+                "error = 'lease expired', updated_at = ? "
+                "WHERE run_id = ? AND status = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, now, run_id, LEASED, now, MAX_ATTEMPTS)
+            )
+            apps = [app for (app,) in conn.execute(
+                "SELECT app FROM work_items WHERE run_id = ? "
+                "AND (status = ? OR (status = ? AND lease_expires < ?)) ORDER BY app LIMIT ?",
+                (run_id, PENDING, LEASED, now, limit)
+            )]
+            conn.executemany(
+                "UPDATE work_items SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE run_id = ? AND app = ?",
+                [(LEASED, worker, now + self.lease_seconds, now, run_id, app) for app in apps]
+            )
+            return apps
+
+        apps = self._transaction(_claim)
+        if apps:
+            count("queue_claims", len(apps))
+        return apps
+
+    def renew(self, run_id, worker, apps):
+        """Extend the worker's leases on `apps`; returns the apps it still holds."""
+        def _renew(conn):
+            now = time.time()
+            held = []
+            for app in apps:
+                updated = conn.execute(
+                    "UPDATE work_items SET lease_expires = ?, updated_at = ? "
+                    "WHERE run_id = ? AND app = ? AND worker = ? AND status = ? AND lease_expires >= ?",
+                    (now + self.lease_seconds, now, run_id, app, worker, LEASED, now)
+                ).rowcount
+                if updated:
+                    held.append(app)
+            return held
+        return self._transaction(_renew)
+
+    def _finish(self, run_id, worker, apps, status, error=None):
+        def _update(conn):
+            now = time.time()
+            conn.executemany(
+                "UPDATE work_items SET status = CASE WHEN ? = ? AND attempts >= ? THEN ? ELSE ? END, "
+                "worker = NULL, lease_expires = NULL, error = ?, updated_at = ? "
+                "WHERE run_id = ? AND app = ? AND worker = ? AND status = ?",
+                [(status, PENDING, MAX_ATTEMPTS, FAILED, status, error, now, run_id, app, worker, LEASED)
+                 for app in apps]
+            )
+        self._transaction(_update)
+
+    def complete(self, run_id, worker, apps):
+        self._finish(run_id, worker, apps, DONE)
+
+    def release(self, run_id, worker, apps, error=None):
+        """Give the apps back to the queue (failed for good after MAX_ATTEMPTS)."""
+        self._finish(run_id, worker, apps, PENDING, error)
+
+    def status(self, run_id):
+        """{status: number of apps} for the run."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM work_items WHERE run_id = ? GROUP BY status", (run_id,)
+            ).fetchall()
+        return dict(rows)
+
+    def failures(self, run_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT app, attempts, error FROM work_items WHERE run_id = ? AND status = ? ORDER BY app",
+                (run_id, FAILED)
+            ).fetchall()
+
+    def outstanding(self, run_id):
+        """Number of the run's apps that are neither done nor failed."""
+        status = self.status(run_id)
+        return status.get(PENDING, 0) + status.get(LEASED, 0)
+
+
+class _Heartbeat:
+    """Renews a batch's leases in the background; `held` shrinks if one is lost."""
+
+    def __init__(self, queue, run_id, worker, apps):
+        self.queue = queue
+        self.run_id = run_id
+        self.worker = worker
+        self.held = list(apps)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+
+    def _beat(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            self.renew()
+
+    def renew(self):
+        try:
+            held = self.queue.renew(self.run_id, self.worker, self.held)
+        except sqlite3.Error as e:
+            # Try again on the next beat; the lease still has time left
+            print(f"Could not renew leases: {e}")
+            return self.held
+        for app in set(self.held) - set(held):
+            print(f"Lost the lease on '{app}'; another worker will handle it")
+            count("queue_leases_lost")
+        self.held = held
+        return held
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self._stop.set()
+        self._thread.join()
+
+
+def process_apps(config_file, app_names, write="both", local_warehouse=None, upsert_days=0, before_write=None):
+    """
+    Fetch, clean and write `app_names`. `before_write(apps)` returns the
+    apps that may still be written (the worker's fence); the rest are dropped.
+    Returns (written, failed): the apps that reached every sink, and
+    {app: reason} for the writable apps that didn't.
+    """
+    from cleaning import clean_ga4_data_all_apps
+
+    all_apps_monthly_data = clean_ga4_data_all_apps(config_file, app_names=app_names, upsert_days=upsert_days)
+    writable = list(app_names)
+    if before_write is not None:
+        writable = before_write(writable)
+        all_apps_monthly_data = {app: data for app, data in all_apps_monthly_data.items() if app in writable}
+
+    # Cleaning leaves out apps whose fetch failed; the writers skip (and log)
+    # apps they couldn't write. Only apps every sink took count as written.
+    failed = {app: "no data cleaned" for app in writable if not all_apps_monthly_data.get(app)}
+    if write in ("app", "both") and writable:
+        from app_level_data import append_new_unique_rows_all_apps
+        done = append_new_unique_rows_all_apps(config_file, all_apps_monthly_data, upsert_days, app_names=writable)
+        for app in writable:
+            if app not in done:
+                failed.setdefault(app, "app sheet not written")
+    if write in ("warehouse", "both") and writable:
+        from google_sheet import append_all_apps_to_sheets
+        done = append_all_apps_to_sheets(config_file, all_apps_monthly_data, app_names=writable)
+        for app in writable:
+            if app not in done:
+                failed.setdefault(app, "warehouse tab not written")
+    if local_warehouse and writable:
+        from local_warehouse import write_all_apps_to_local
+        write_all_apps_to_local(all_apps_monthly_data, local_warehouse)
+    return [app for app in writable if app not in failed], failed
+
+
+def run_worker(queue, run_id, config_file="apps_config.json", batch_size=DEFAULT_BATCH_SIZE, write="both",
+               local_warehouse=None, upsert_days=0, worker=None):
+    """Claim and process batches until every app of the run is done or failed."""
+    worker = worker or worker_id()
+    print(f"Worker {worker} joining run '{run_id}'")
+    processed = 0
+    while True:
+        apps = queue.claim(run_id, worker, batch_size)
+        if not apps:
+            if not queue.outstanding(run_id):
+                break
+            # Others still hold leases; their apps come back here if they die
+            time.sleep(IDLE_POLL_SECONDS)
+            continue
+
+        print(f"Claimed {len(apps)} app(s): {', '.join(apps)}")
+        with _Heartbeat(queue, run_id, worker, apps) as heartbeat:
+            try:
+                with stage("queue_batch"):
+                    written, failed = process_apps(config_file, apps, write, local_warehouse, upsert_days,
+                                                   before_write=lambda _: heartbeat.renew())
+            except Exception as e:
+                print(f"Batch failed: {e}")
+                traceback.print_exc()
+                queue.release(run_id, worker, heartbeat.held, error=str(e))
+                continue
+            queue.complete(run_id, worker, [app for app in written if app in heartbeat.held])
+            # Back to the queue (failed for good after MAX_ATTEMPTS) for another try
+            for app, reason in failed.items():
+                if app in heartbeat.held:
+                    print(f"'{app}' not written: {reason}")
+                    queue.release(run_id, worker, [app], error=reason)
+            processed += len(written)
+
+    print(f"Worker {worker} done: {processed} app(s) processed, run status {queue.status(run_id)}")
+    for app, attempts, error in queue.failures(run_id):
+        print(f"  '{app}' failed after {attempts} attempt(s): {error}")
+    return processed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Spread a pipeline run over several workers.")
+    parser.add_argument("command", choices=["enqueue", "work", "status"])
+    parser.add_argument("--run-id", default=time.strftime("%Y-%m-%d"))
+    parser.add_argument("--config", default="apps_config.json")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE_PATH)
+    parser.add_argument("--lease", type=int, default=DEFAULT_LEASE_SECONDS, help="Lease length in seconds")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH_SIZE, help="Apps claimed at a time")
+    parser.add_argument("--write", choices=["none", "app", "warehouse", "both"], default="both")
+    parser.add_argument("--local-warehouse", metavar="DIR")
+    parser.add_argument("--upsert-days", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    queue = WorkQueue(args.queue, args.lease)
+    if args.command == "enqueue":
+        with open(args.config) as f:
+            app_names = [c.get("app_name", "Unnamed") for c in json.load(f)]
+        added = queue.enqueue(args.run_id, app_names)
+        print(f"Queued {added} new app(s) for run '{args.run_id}' ({len(app_names)} in {args.config})")
+    elif args.command == "work":
+        run_worker(queue, args.run_id, args.config, args.batch, args.write, args.local_warehouse, args.upsert_days)
+        export_metrics()
+    print(f"Run '{args.run_id}': {queue.status(args.run_id)}")
+    queue.close()
+
+
+if __name__ == "__main__":
+    main()